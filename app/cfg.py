@@ -5,9 +5,15 @@ import logging
 import ipywidgets as widgets
 import threading
 
-from app.model import Model
-from app.view import View
-from app.controller import Controller
+from lib.python import paths
+from lib.python.startup import timed
+
+with timed("import app.model"):
+    from app.model import Model
+with timed("import app.view"):
+    from app.view import View
+with timed("import app.controller"):
+    from app.controller import Controller
 
 class Const:
     """Store app-wide constants, including values and language text."""
@@ -110,12 +116,21 @@ class Const:
     }
 
     # Selection tab
-    RAW_DATA_DIR = '/data/tools/agmip/rdata/'
-    COMBINED_CACHE_DIR = 'cache/combined/'
-    AGGREGATED_CACHE_DIR = 'cache/aggregated/'
+    # also the defaults of the command line tools, see lib/python/paths.py
+    RAW_DATA_DIR = paths.RAW_DATA_DIR
+    # minimum time between two checks of RAW_DATA_DIR for new or removed files, in seconds
+    CATALOG_POLL_INTERVAL = 30
+    COMBINED_CACHE_DIR = paths.COMBINED_CACHE_DIR
+    CHUNKED_DATA_DIR = paths.CHUNKED_DATA_DIR
+    AGGREGATED_CACHE_DIR = paths.AGGREGATED_CACHE_DIR
+    METADATA_INDEX = paths.METADATA_INDEX
     WEIGHT_MAP_DIR = 'data/weightmap/'
     WEIGHT_MAP_UPLOAD_DIR = 'cache/weightmaps/'
     R_SCRIPT_DIR = 'lib/rfunctions/'
+    # 'python' aggregates in-process with lib/python/aggregate.py,
+    # 'r' uses the legacy R code through a persistent worker running lib/rfunctions/worker.r
+    AGGREGATION_ENGINE = 'python'
+    R_WORKER_SCRIPT = 'lib/rfunctions/worker.r'
 
     REGION_MAP_DIR = 'data/regionmap/'
     REGION_MAP_UPLOAD_DIR = 'cache/regionmaps/'
@@ -127,6 +142,46 @@ class Const:
         ("Regional Weighted-Average Yields (metric tons / hectare)", 'wa')
     ]
 
+    # countries of the map, and their simplified levels of detail by map zoom:
+    # (largest zoom, tolerance in degrees), see lib/python/geometry.py
+    GEODATA = 'data/countries.geo.json'
+    GEODATA_LEVELS = [
+        (2,    0.25),
+        (4,    0.08),
+        (None, 0),
+    ]
+    # years per second when playing the map, see View.play
+    MAP_FRAME_RATE = 4
+    # minimum time between two updates of the info panels while the year changes, in seconds
+    YEAR_UPDATE_INTERVAL = 0.25
+    # outputs kept for previous inputs by the ComputedProps of the info panels, see ComputedProp
+    PROP_CACHE_SIZE = 32
+    # downloads are streamed by a server in the kernel, see lib/python/download.py.
+    # DOWNLOAD_URL is relative to the Jupyter base URL, through jupyter-server-proxy, or absolute,
+    # e.g. 'http://localhost:{port}/download/{token}' without a proxy
+    DOWNLOAD_PORT = 0
+    DOWNLOAD_URL = 'proxy/{port}/download/{token}'
+    # the time a download can be started after a click on its button, in seconds
+    DOWNLOAD_TOKEN_TTL = 60
+    # record what every prop does from startup, see lib/python/prop.py instrument, prop_stats and export_graph
+    PROP_INSTRUMENTATION = False
+    # styles of the regions on the map, see View.set_year_styles
+    MAP_REGION_OPACITY = 1.0
+    MAP_NAN_COLOR = 'black'
+    MAP_NAN_OPACITY = 0.4
+
+    # stages reported by a background aggregation: (stage, label, share of the progress bar)
+    AGGREGATION_STAGES = [
+        ('read',   "Reading data",           0.6),
+        ('join',   "Joining region map",     0.05),
+        ('reduce', "Aggregating",            0.3),
+        ('write',  "Writing results",        0.05),
+    ]
+    # stages reported while a job can't be cancelled, e.g. while a whole RData file is read: { stage: label, ... }
+    UNCANCELLABLE_STAGES = {
+        'load': "Loading RData file (can't be cancelled)",
+    }
+
     PRIMARY_VAR = {
         'pr': 'production',
         'yi': 'harea.w.yield',
@@ -2,20 +2,19 @@
 # rcampbel@purdue.edu - 2020-07-14
 
 import traceback
-from IPython.display import display, clear_output, FileLink
-from jupyterthemes import jtplot
-from matplotlib import pyplot as plt
-import ipywidgets as widgets
-from ipyleaflet import Choropleth, WidgetControl
-import subprocess
-from lib.python import SyncedProp
-import numpy as np
+from lib.python import SyncedProp, batch
+from lib.python.prop import instrument, label_props, activate_when
 import os
-import re
-from lib.python.utils import get_yield_variable, get_colormap, get_dir_content, get_summary_info
-import netCDF4
-import json
-import csv
+from lib.python.utils import get_summary_info
+from lib.python.aggregate import aggregate_file, aggregate_ensemble, ENSEMBLE_PREFIX
+from lib.python.gridmap import load_region_map, load_weight_map
+from lib.python import cache
+from lib.python.jobs import Job
+from lib.python.debounce import Debouncer
+from lib.python.cube import RegionCube
+from lib.python.rworker import get_worker
+from lib.python.startup import timed, report
+from lib.python.download import get_server
 
 class Controller():
 
@@ -26,6 +25,19 @@ class Controller():
         global model, view, logger, Const, send_notification
         from app.cfg import model, view, logger, Const, send_notification
 
+        if Const.PROP_INSTRUMENTATION:
+            instrument()
+        with timed("Controller.start"):
+            self.connect()
+        # on the kernel's event loop, before any download button is clicked
+        get_server(Const.DOWNLOAD_PORT, Const.DOWNLOAD_URL, Const.DOWNLOAD_TOKEN_TTL)
+        # readable names in the prop graph, see lib.python.prop.export_graph
+        label_props(model, "model")
+        label_props(view, "view")
+        logger.info('Startup times:\n' + report())
+
+    def connect(self):
+        """Connect the model and the view."""
         try:
             ####################
             #  Data Selection  #
@@ -38,17 +50,32 @@ class Controller():
             # model.data_file_path, model.radio_selections_info
             for category, prop in model.radio_selections:
                 model.radio_selections_info << (prop, dict(name=category))
+                model.unavailable_options << (prop, dict(name=category))
                 model.data_file_path << prop # calculating data path doesn't need the name
             # TODO: refactor the method below into a lambda <2022-05-03, David Deng> #
             model.data_file_path >> model.get_data_file_path
             model.radio_selections_info >> (lambda **kwargs: kwargs) # output a dictionary
+            model.unavailable_options >> model.get_unavailable_options
+
+            SyncedProp() \
+                << (model.unavailable_options, dict(sync=True, trans=view.get_unavailable_options_style)) \
+                >> (view.radio_styles, dict(sync=True))
 
             model.selected_file \
                 << (model.data_file_path, dict(name="path")) \
-                >> (lambda path: path if path in get_dir_content(Const.RAW_DATA_DIR) else None)
+                >> (lambda path: path if path in model.catalog else None)
+
+            model.selected_file_metadata \
+                << (model.selected_file, dict(name="f")) \
+                << (model.radio_selections[-1][1], dict(name="crop")) \
+                >> model.get_selected_file_metadata
+
+            model.ensemble_files \
+                << (model.radio_selections[2][1], dict(name="scenario")) \
+                >> model.get_ensemble_files
 
             SyncedProp() \
-                << (model.selected_file, dict(sync=True)) \
+                << (model.ensemble_files, dict(sync=True)) \
                 >> (view.folder_file_multi_select, dict(prop='options', sync=True))
 
             model.select_all \
@@ -56,12 +83,11 @@ class Controller():
                 >> (view.folder_file_multi_select, dict(prop='disabled', sync=True))
 
             model.selected_files \
-                << (model.data_file_path, dict(name="path")) \
                 << (view.folder_file_multi_select, dict(prop="value", name="selected_files")) \
                 << (view.folder_file_multi_select, dict(prop="options", name="all_files")) \
                 << (model.select_all, dict(name="select_all")) \
-                >> (lambda path, select_all, selected_files, all_files:
-                    [ os.path.join(path, file) for file in (all_files if select_all else selected_files) ])
+                >> (lambda select_all, selected_files, all_files:
+                    list(all_files if select_all else selected_files))
 
             model.selection_info \
                 << (model.start_year, dict(name="start")) \
@@ -69,8 +95,13 @@ class Controller():
                 << (model.radio_selections_info, dict(name="model_info")) \
                 >> (lambda start, end, model_info: {'Year Range': f"{start}-{end}", **model_info})
 
+            model.raw_download_file_name \
+                << (model.selected_file, dict(name="f")) \
+                << (model.radio_selections[-1][1], dict(name="crop")) \
+                >> model.get_raw_download_file_name
+
             SyncedProp() \
-                << (model.selected_file, dict(sync=True)) \
+                << (model.raw_download_file_name, dict(sync=True)) \
                 >> (view.raw_download_btn, dict(prop="filename", sync=True))
 
             ######################
@@ -95,57 +126,96 @@ class Controller():
                 << (model.aggregated_download_file_name, dict(sync=True)) \
                 >> (view.aggregated_download_btn, dict(prop="filename", sync=True))
 
+            model.aggregation_key \
+                << (model.selected_file, dict(name="f")) \
+                << (model.radio_selections[-1][1], dict(name="crop")) \
+                << (view.aggregation_options, dict(name="op")) \
+                << (view.region_map_select_upload, dict(name="region_map")) \
+                << (view.weight_map_select_upload, dict(name="weight_map")) \
+                >> model.get_aggregation_key
+
+            model.aggregated_file \
+                << (model.aggregation_key, dict(name="key")) \
+                >> (lambda key: cache.lookup(Const.AGGREGATED_CACHE_DIR, key))
+
+            SyncedProp() \
+                << (model.aggregated_file, dict(sync=True, trans=lambda f: f is None)) \
+                >> (view.aggregated_download_btn, dict(prop='disabled', sync=True))
+
 
             view.aggregate_btn.on_click(self.cb_aggregate)
+            view.ensemble_aggregate_btn.on_click(self.cb_aggregate_ensemble)
+            view.aggregation_cancel_btn.on_click(self.cb_cancel_aggregation)
+
+            SyncedProp() \
+                << (model.ensemble_file, dict(sync=True, trans=lambda f: f is None)) \
+                >> (view.ensemble_download_btn, dict(prop='disabled', sync=True))
+
+            if Const.AGGREGATION_ENGINE == 'r':
+                # warm up the worker while the user makes a selection
+                get_worker(Const.R_WORKER_SCRIPT).start()
+
+            # the running aggregation job, if any
+            self.job = None
+            # { stage: (label, progress at the start of the stage, share of the stage) }
+            self.aggregation_stages = {}
+            offset = 0.0
+            for stage, label, share in Const.AGGREGATION_STAGES:
+                self.aggregation_stages[stage] = (label, offset, share)
+                offset += share
+
+            # compile region and weight maps when they are selected or uploaded, rather than on aggregation
+            view.region_map_select_upload.observe(self.cb_compile_region_map, names='value')
+            view.weight_map_select_upload.observe(self.cb_compile_weight_map, names='value')
 
             ########################
             #  Data Visualization  #
             ########################
 
+            # coalesce the values of the slider while it is dragged or played
+            view.zoom_slider.observe(Debouncer(self.cb_select_year, Const.YEAR_UPDATE_INTERVAL), names='value')
+
             model.selected_info \
                 << (model.selected_country, dict(name="country")) \
-                << (model.choro_data, dict(name="data")) \
-                >> (lambda country, data: {
-                    "Name": country,
-                    "Production": round(data.get(country, 0), 2),
-                })
+                << (model.selected_year, dict(name="year")) \
+                << (model.prod_data, dict(name="cube")) \
+                >> model.get_selected_info
 
             model.time_series_info \
                 << (model.selected_country, dict(name="country")) \
-                << (model.start_year, dict(name="start")) \
-                << (model.end_year, dict(name="end")) \
-                << (model.prod_data, dict(name="full_data")) \
-                >> (lambda start, end, country, full_data: {
-                    "x": np.arange(start, end+1, 1),
-                    "y": np.array([ d[country] for d in full_data.values() ])
-                })
+                << (model.prod_data, dict(name="cube")) \
+                >> (lambda country, cube: {
+                    "x": cube.years,
+                    "y": cube.series(country),
+                } if country in cube.index else None)
 
             model.summary_info \
-                << (model.choro_data, dict(name="choro")) \
-                >> (lambda choro: get_summary_info(choro.values()))
+                << (model.selected_year, dict(name="year")) \
+                << (model.prod_data, dict(name="cube")) \
+                >> (lambda year, cube: get_summary_info(cube.year_statistics(year)))
+
+            model.visualize_info_visible \
+                << (view.tabs, dict(prop="selected_index", name="tab")) \
+                << (view.visualize_info, dict(prop="selected_index", name="section")) \
+                >> (lambda tab, section: tab == Const.TAB_TITLES.index('Data Visualization') and section == 0)
+
+            activate_when(model.visualize_info_visible,
+                          model.selected_info, model.summary_info, model.time_series_info)
 
             # add callback to map
             view.map.on_interaction(self.cb_set_coordinates)
-
-            model.choro_data \
-                << (view.zoom_slider, dict(name='selected_year', sync=False)) \
-                << (model.prod_data, dict(name='prod_data', sync=False)) \
-                >> (lambda prod_data, selected_year: prod_data.get(selected_year, None))
+            view.on_region_click(self.cb_popup)
+            view.map.observe(self.cb_map_zoom, names='zoom')
+            view.global_scale_checkbox.observe(self.cb_global_scale, names='value')
 
             SyncedProp() \
                 << (model.selected_file, dict(sync=True, trans=lambda f: f is None)) \
                 >> (view.raw_download_btn, dict(prop='disabled', sync=True))
 
-            # TODO: Fix Choropleth so that can automatically trigger update upon changing choro_data without creating new instance?
-            # This is also challenging because Choropleth's choro_data attribute is very picky. E.g. no empty value allowed, etc.
-            # Current solution is to manually update the view.choro.choro_data attribute upon changing the slider.
-            # # model.choro_data.value <-> view.choro.choro_data
-            # SyncedProp() \
-            #     .add_input_prop(model.choro_data) \
-            #     .add_output_prop(view.choro, 'choro_data')
-
-            # Register callbacks
-            view.zoom_slider.observe(self.cb_refresh_map, names='value')
+            # NOTE: the region layer isn't restyled from the kernel when the slider moves.
+            # The colors of every year are sent once by View.set_year_styles, and the script
+            # in custom.html restyles the map in the browser. The kernel only handles the values
+            # of the slider every Const.YEAR_UPDATE_INTERVAL, which updates the info panels.
 
             logger.info('App running')
 
@@ -153,8 +223,17 @@ class Controller():
             logger.debug('Exception while setting up callbacks...\n'+traceback.format_exc())
             raise
 
-    def cb_refresh_map(self, change):
-        self.refresh_map()
+    def cb_map_zoom(self, change):
+        # switch the level of detail once a map is drawn
+        if view.choro is not None:
+            view.show_regions(change['new'])
+
+    def cb_select_year(self, change):
+        model.selected_year.value = change['new']
+
+    def cb_global_scale(self, change):
+        if model.prod_data.value is not None:
+            view.set_year_styles(model.prod_data.value, change['new'])
 
     def cb_popup(self, **kwargs):
         model.selected_country.value = kwargs['feature']['id']
@@ -168,6 +247,18 @@ class Controller():
             # record the coordinate clicked
             model.coordinates = kwargs['coordinates']
 
+    def cb_compile_region_map(self, change):
+        try:
+            load_region_map(change['new'])
+        except Exception:
+            logger.error(f"Invalid region map {change['new']}:\n" + traceback.format_exc())
+
+    def cb_compile_weight_map(self, change):
+        try:
+            load_weight_map(change['new'])
+        except Exception:
+            logger.error(f"Invalid weight map {change['new']}:\n" + traceback.format_exc())
+
     def cb_aggregate(self, _):
         # input_file = "data/epic_hadgem2-es_hist_ssp2_co2_firr_yield_soy_annual_1980_2010.nc4"
         send_notification("Aggregating data...")
@@ -190,75 +281,192 @@ class Controller():
             logger.error("Trying to aggregate with end year of None")
             return
 
-        cmd = [
-            "Rscript",
-            os.path.join(Const.R_SCRIPT_DIR, "do.r"),
-            os.path.join(Const.RAW_DATA_DIR, input_file),
-            regionmap_file,
-            weightmap_file,
-            crop,
-            "out.csv",
-        ]
-        result = subprocess.run(cmd, capture_output=True)
-        logger.info(" ".join(cmd))
-        if result.returncode == 0:
-            logger.info(f"R script completed: {result.stdout.decode('utf-8')}")
-            send_notification("Successfully aggregated data!")
-            view.switch_to_tab(3)
-            self.cb_draw_map(None)
-        else:
-            logger.error(f"R script failed with return code {result.returncode}: {result.stderr.decode('utf-8')}")
+        if input_file is None:
+            logger.error("Trying to aggregate without a selected file")
+            return
+
+        # the region and weight map may have been re-uploaded under the same name since the key was computed
+        key = model.aggregation_key.resync().value
+        if key is None:
+            logger.error("Trying to aggregate with missing input files")
+            return
+
+        primary_variable = Const.PRIMARY_VAR.get(aggregation_option)
+        cached = cache.lookup(Const.AGGREGATED_CACHE_DIR, key)
+        if cached is not None:
+            logger.info(f"Aggregation served from cache: {key}")
+            self.cb_aggregation_done((cached, primary_variable))
+            return
+
+        input_path = os.path.join(Const.RAW_DATA_DIR, input_file)
+        logger.info(f"Aggregating {input_path} with {regionmap_file}, option {aggregation_option}")
+        info = cache.aggregation_info(input_path, regionmap_file, weightmap_file, crop, aggregation_option,
+                                      engine=Const.AGGREGATION_ENGINE)
+
+        def run(progress):
+            if Const.AGGREGATION_ENGINE == 'r':
+                os.makedirs(Const.AGGREGATED_CACHE_DIR, exist_ok=True)
+                output = os.path.join(Const.AGGREGATED_CACHE_DIR, f"{key}.r.csv")
+                rows = get_worker(Const.R_WORKER_SCRIPT).aggregate(
+                    os.path.abspath(input_path),
+                    os.path.abspath(regionmap_file),
+                    os.path.abspath(weightmap_file) if aggregation_option == 'wa' else None,
+                    crop,
+                    aggregation_option,
+                    os.path.abspath(output),
+                    poll=lambda: progress('reduce', 0.0))
+                progress('write', 0.0)
+                path = cache.save_csv(output, Const.AGGREGATED_CACHE_DIR, key, info)
+            else:
+                result = aggregate_file(input_path,
+                                        crop=crop,
+                                        option=aggregation_option,
+                                        region_map=regionmap_file,
+                                        weight_map=weightmap_file if aggregation_option == 'wa' else None,
+                                        start_year=start_year,
+                                        store_dir=Const.CHUNKED_DATA_DIR,
+                                        progress=progress)
+                progress('write', 0.0)
+                path = cache.save(result, Const.AGGREGATED_CACHE_DIR, key, info)
+                rows = len(result)
+            return path, rows
+
+        def done(result):
+            path, rows = result
+            logger.info(f"Aggregation completed: {rows} rows")
+            self.index_aggregation(path)
+            self.cb_aggregation_done((path, primary_variable))
+
+        self.start_aggregation(run, done)
+
+    def cb_aggregate_ensemble(self, _):
+        send_notification("Aggregating ensemble...")
+        files = model.selected_files.value
+        aggregation_option = view.aggregation_options.value
+        weightmap_file = view.weight_map_select_upload.value if aggregation_option == 'wa' else None
+        regionmap_file = view.region_map_select_upload.value
+        crop = model.radio_selections[-1][1].value
+        start_year = model.start_year.value
+
+        if not files:
+            logger.error("Trying to aggregate an ensemble without selected files")
+            return
+
+        paths = [ os.path.join(Const.RAW_DATA_DIR, f) for f in files ]
+        try:
+            key = cache.ensemble_key([ cache.aggregation_key(path, regionmap_file, weightmap_file, crop, aggregation_option)
+                                       for path in paths ])
+        except OSError:
+            logger.error("Trying to aggregate an ensemble with missing input files:\n" + traceback.format_exc())
+            return
+        logger.info(f"Aggregating an ensemble of {len(paths)} files, option {aggregation_option}")
+
+        def run(progress):
+            path = cache.lookup(Const.AGGREGATED_CACHE_DIR, key)
+            if path is not None:
+                return path, None
+            result = aggregate_ensemble(paths,
+                                        crop=crop,
+                                        option=aggregation_option,
+                                        region_map=regionmap_file,
+                                        weight_map=weightmap_file,
+                                        start_year=start_year,
+                                        store_dir=Const.CHUNKED_DATA_DIR,
+                                        progress=progress)
+            progress('write', 0.0)
+            info = cache.aggregation_info(paths, regionmap_file, weightmap_file, crop, aggregation_option)
+            return cache.save(result, Const.AGGREGATED_CACHE_DIR, key, info), len(result)
+
+        def done(result):
+            path, rows = result
+            if rows is None:
+                logger.info(f"Ensemble aggregation served from cache: {key}")
+            else:
+                logger.info(f"Ensemble aggregation completed: {rows} rows")
+                self.index_aggregation(path)
+            model.ensemble_file.value = path
+            view.ensemble_download_btn.filename = f"ensemble_{model.radio_selections[2][1].value}_{crop}.csv"
+            self.cb_aggregation_done((path, ENSEMBLE_PREFIX + "mean"))
+
+        self.start_aggregation(run, done)
+
+    def index_aggregation(self, path):
+        """ Add a new aggregation result to the metadata index, a failure only leaves it unindexed """
+        try:
+            model.metadata.index_file('aggregation', path)
+        except Exception:
+            logger.warning(f"Could not index {path}:\n" + traceback.format_exc())
+
+    def start_aggregation(self, run, on_done):
+        """ run an aggregation in the background, showing its progress
+
+        :run: function taking a progress callback, run in a thread: it shouldn't touch props, widgets or the log
+        :on_done: called with the return value of run, on the kernel's event loop like the other callbacks
+        """
+        self.cb_aggregation_progress('read', 0.0)
+        self.job = Job(run,
+                       on_progress=self.cb_aggregation_progress,
+                       on_done=on_done,
+                       on_error=self.cb_aggregation_error,
+                       on_cancel=self.cb_aggregation_cancelled).start()
+
+    def cb_cancel_aggregation(self, _):
+        if self.job is not None and self.job.running:
+            logger.info("Cancelling aggregation...")
+            self.job.cancel()
+
+    def cb_aggregation_progress(self, stage, fraction):
+        if stage in Const.UNCANCELLABLE_STAGES:
+            view.show_aggregation_progress(Const.UNCANCELLABLE_STAGES[stage], None, cancellable=False)
+            return
+        label, offset, share = self.aggregation_stages[stage]
+        view.show_aggregation_progress(label, offset + share * fraction)
+
+    def cb_aggregation_done(self, result):
+        path, primary_variable = result
+        view.show_aggregation_progress(None)
+        model.aggregated_file.resync()
+        model.selected_file_metadata.resync()
+        send_notification("Successfully aggregated data!")
+        view.switch_to_tab(3)
+        self.draw_map(path, primary_variable)
+
+    def cb_aggregation_error(self, tb):
+        view.show_aggregation_progress(None)
+        logger.error("Aggregation failed:\n" + tb)
+        send_notification("Aggregation failed, see the log for details.")
+
+    def cb_aggregation_cancelled(self):
+        view.show_aggregation_progress(None)
+        logger.info("Aggregation cancelled")
+        send_notification("Aggregation cancelled.")
 
     def cb_draw_map(self, _):
+        self.draw_map(model.aggregated_file.value, Const.PRIMARY_VAR.get(view.aggregation_options.value))
+
+    def draw_map(self, path, primary_variable):
+        """ draw the primary_variable of the aggregation result in path on the map """
         logger.info("Drawing map...")
-        primary_variable = Const.PRIMARY_VAR.get(view.aggregation_options.value)
 
         logger.info("primary_variable: {}".format(primary_variable))
 
-        # retrieve and process all data
+        # one column per country of the map, NaN where there is no value
         country_keys = [d['id'] for d in model.geodata['features']]
-        countries = dict.fromkeys(country_keys, 0.0)
-
-        # update prod_data
-        prod_data = {}
-        # prod_data = {1980: { 'AFG': 0, 'AGO': 135, ...}}
-        with open('out.csv', 'r') as f:
-            for row in csv.DictReader(f):
-                year = int(row['time'])
-                country = row['id']
-                # TODO: handle NA values <2022-03-19, David Deng> #
-                try:
-                    value = float(row[primary_variable])
-                except ValueError as e:
-                    # logger.error(e)
-                    value = 0
-                prod_data.setdefault(year, countries.copy())
-                if country in prod_data[year]:
-                    prod_data[year][country] = value
-
-        model.prod_data.value = prod_data
-
-        # reset zoom slider
-        # NOTE: first set to 0 to prevent min > max error <2022-03-04, David Deng> #
-        view.zoom_slider.min = 0
-        view.zoom_slider.max = model.end_year.value
-        view.zoom_slider.min = model.start_year.value
-        view.zoom_slider.value = model.start_year.value
-
-        view.reset_map_choro(model.choro_data.value)
-        view.choro.on_click(self.cb_popup)
-
-        self.refresh_map()
+        prod_data = RegionCube.from_result(cache.load(path), primary_variable, country_keys)
 
-        send_notification("Successfully drawn map!")
+        # the props depending on the data, the slider and the year are recomputed once, at the end
+        with batch():
+            model.prod_data.value = prod_data
 
-    def refresh_map(self):
-        if model.choro_data.value is not None:
-            view.refresh_map_choro(model.choro_data.value)
+            # reset zoom slider
+            # NOTE: first set to 0 to prevent min > max error <2022-03-04, David Deng> #
+            view.zoom_slider.min = 0
+            view.zoom_slider.max = model.end_year.value
+            view.zoom_slider.min = model.start_year.value
+            view.zoom_slider.value = model.start_year.value
+            model.selected_year.value = view.zoom_slider.value
 
-            # # uncomment the following lines to show more visible update upon refreshing map
-            # import random
-            # view.refresh_map_choro({ k:v*random.uniform(0.5,1.5) for k,v in model.choro_data.value.items() })
+        view.show_regions()
+        view.set_year_styles(prod_data, view.global_scale_checkbox.value)
 
-            view.refresh_map_colormap()
-            logger.debug("Map refreshed.")
+        send_notification("Successfully drawn map!")
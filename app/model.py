@@ -3,9 +3,18 @@
 
 import os
 import csv
+import math
 import glob
-import pandas as pd
+import tempfile
 from lib.python import SyncedProp, ComputedProp, Prop
+from lib.python.rawdata import has_store, extract_crop
+from lib.python.cache import aggregation_key
+from lib.python.catalog import FIELDS, file_name, get_catalog
+from lib.python.metadata import MetadataIndex
+from lib.python.download import file_chunks
+from lib.python.jobs import Job
+from lib.python.geometry import level_path
+from lib.python.startup import timed
 import json
 
 class Model:
@@ -14,6 +23,7 @@ class Model:
         # The models's "public" attributes are listed here, with type hints, for quick reference
         self.coordinates: list = [0,0]
 
+    @timed("Model.start")
     def start(self):
         """Read data and/or prepare to query data."""
 
@@ -25,19 +35,35 @@ class Model:
         #  Data Selection  #
         ####################
 
+        # the raw data files, listed again when Const.RAW_DATA_DIR changes
+        self.catalog = get_catalog(Const.RAW_DATA_DIR, Const.CATALOG_POLL_INTERVAL)
+        # the metadata of the raw data files and of the cached aggregations, see lib/python/metadata.py
+        self.metadata = MetadataIndex(Const.METADATA_INDEX)
+        # index the raw data files and stores added since the last session, in the background
+        Job(self.update_metadata,
+            on_done=lambda _: self.selected_file_metadata.resync(),
+            on_error=lambda tb: logger.warning("Could not update the metadata index:\n" + tb)).start()
+
         # a list of (category_name: str, prop: SyncedProp), indicating the crop selection for each category
         self.radio_selections = [ (category['label'], SyncedProp(value=None)) for category in Const.DATA_CATEGORIES ]
         # a dictionary of values
         self.radio_selections_info = ComputedProp()
 
+        # [[index, ...], ...] the options of each category without a file for the other selections
+        self.unavailable_options = ComputedProp()
+
         # the path to search for input files, based on the radio_selections
         self.data_file_path = ComputedProp()
         # the files available in data_file_path
         self.selected_file = ComputedProp()
+        # a dictionary describing the selected file and its cached aggregations
+        self.selected_file_metadata = ComputedProp()
 
-        # whether to select all files in data_file_path
+        # the files available for the selected scenario, across all crop models and GCMs
+        self.ensemble_files = ComputedProp()
+        # whether to select all files in ensemble_files
         self.select_all = SyncedProp(value=False)
-        # the selected files
+        # the files selected for an ensemble aggregation
         self.selected_files = ComputedProp()
 
         # a dictionary summarizing the selection info
@@ -47,6 +73,7 @@ class Model:
         # 'agmip_files': [..., ...]
         self.selection_info = ComputedProp()
 
+        # the selected crop in netCDF4 when the selected file has a chunked store, the RData file otherwise
         self.raw_download_file_name = ComputedProp()
 
         ######################
@@ -63,28 +90,53 @@ class Model:
 
         self.aggregation_info = ComputedProp()
 
+        # the key of the current selection in Const.AGGREGATED_CACHE_DIR
+        self.aggregation_key = ComputedProp()
+        # the path to the cached aggregation result of the current selection, None if not aggregated yet
+        self.aggregated_file = ComputedProp()
+        # the path to the last ensemble aggregation result, None if there is none
+        self.ensemble_file = Prop(value=None)
+
         ########################
         #  Data Visualization  #
         ########################
 
-        # TODO: move to Const <2022-05-03, David Deng> #
-        with open('data/countries.geo.json', 'r') as f:
-            self.geodata = json.load(f)
+        # { tolerance: geojson, ... }, loaded on demand, see get_geodata
+        self._geodata_levels = {}
+
+        # production data, a RegionCube of the primary variable of the drawn aggregation
+        self.prod_data = Prop(value=None)
 
-        self.prod_data = Prop(value=None) # production data
-        self.choro_data = ComputedProp()
+        # the year shown on the map, follows the year slider at most every Const.YEAR_UPDATE_INTERVAL
+        self.selected_year = Prop(value=None)
 
         # mapinfo related data
         self.selected_country = SyncedProp(value=None)
-        self.selected_info = ComputedProp()
-        self.summary_info = ComputedProp()
+        # whether the info panels of the visualization tab are shown
+        self.visualize_info_visible = ComputedProp(use_none=True)
+        # the info panels keep their outputs for recent years and countries,
+        # and are only evaluated while they are shown, see visualize_info_visible
+        self.selected_info = ComputedProp(cache_size=Const.PROP_CACHE_SIZE, lazy=True)
+        self.summary_info = ComputedProp(cache_size=Const.PROP_CACHE_SIZE, lazy=True)
 
-        self.time_series_info = ComputedProp()
+        self.time_series_info = ComputedProp(cache_size=Const.PROP_CACHE_SIZE, lazy=True)
 
         self.aggregated_download_file_name = ComputedProp()
 
         logger.info('Data load completed')
 
+    @property
+    def geodata(self):
+        """ The regions of the map, loaded on first use. The coarsest level is enough for their ids. """
+        return self.get_geodata(Const.GEODATA_LEVELS[0][1])
+
+    def get_geodata(self, tolerance):
+        """ Get the countries of the map simplified with tolerance, see lib/python/geometry.py """
+        if tolerance not in self._geodata_levels:
+            with open(level_path(Const.GEODATA, tolerance), 'r') as f:
+                self._geodata_levels[tolerance] = json.load(f)
+        return self._geodata_levels[tolerance]
+
     def get_data_file_path(self):
         """ Get the data file path based on radio_selections """
         # Works because dict is ordered
@@ -93,4 +145,85 @@ class Model:
             return None
         else:
             # acea_gfdl-esm4_historical_default_production_and_yield_grid.RData
-            return "_".join(path_segments[:-1]) + "_default_production_and_yield_grid.RData"
+            return file_name(*path_segments[:-1])
+
+    def get_ensemble_files(self, scenario):
+        """ Get the files in Const.RAW_DATA_DIR for the given scenario """
+        return self.catalog.scenario_files(scenario)
+
+    def get_unavailable_options(self, **selections):
+        """ Get the indices of the options of each category that have no file, given the selections
+        of the other categories. The first categories are the fields of the file names, see
+        lib/python/catalog.py, the crops are in every file.
+
+        :selections: { category label: selected value, ... }
+        """
+        values = list(selections.values())
+        unavailable = []
+        for i, category in enumerate(Const.DATA_CATEGORIES):
+            if i >= len(FIELDS):
+                unavailable.append([])
+                continue
+            others = { field: values[j] for j, field in enumerate(FIELDS) if j != i }
+            available = self.catalog.values(FIELDS[i], **others)
+            unavailable.append([ k for k, (_, key) in enumerate(category['options']) if key not in available ])
+        return unavailable
+
+    def update_metadata(self, progress):
+        """ Index the new and changed raw data files and stores, without hashing the large raw data files """
+        self.metadata.update('raw', Const.RAW_DATA_DIR, hash_contents=False)
+        self.metadata.update('store', Const.CHUNKED_DATA_DIR)
+
+    def get_selected_file_metadata(self, f, crop):
+        """ Get the metadata of the selected file, and the region maps it is already aggregated with for crop """
+        model, gcm, scenario = (p[1].value for p in self.radio_selections[:len(FIELDS)])
+        raw = self.metadata.query('raw', name=f)
+        # until the file is indexed, see update_metadata
+        entry = None if raw else self.catalog.lookup(model, gcm, scenario)
+        size = raw[0]['size'] if raw else entry.size if entry else None
+        info = { "File Size": f"{size / 2**20:.1f} MB" if size is not None else "NA" }
+        stores = self.metadata.query('store', model=model, gcm=gcm, scenario=scenario)
+        if stores:
+            info["Years"] = f"{stores[0]['year_start']}-{stores[0]['year_end']}"
+        aggregations = self.metadata.query('aggregation', model=model, gcm=gcm, scenario=scenario, crop=crop)
+        info["Aggregated For"] = ", ".join(sorted({ f"{a['region_map']} ({a['option']})" for a in aggregations })) or "None"
+        return info
+
+    def get_selected_info(self, country, year, cube):
+        """ Get the info of the selected country in the selected year """
+        value = cube.value(year, country)
+        return {
+            "Name": country,
+            "Production": "NA" if math.isnan(value) else round(value, 2),
+        }
+
+    def get_raw_download_file_name(self, f, crop):
+        """ Get the name of the raw download of the selected file """
+        if has_store(os.path.join(Const.RAW_DATA_DIR, f), Const.CHUNKED_DATA_DIR):
+            return f"{os.path.splitext(f)[0]}_{crop}.nc4"
+        return f
+
+    def get_raw_download(self):
+        """ Get the content of the raw download of the selected file as chunks, see get_raw_download_file_name """
+        path = os.path.join(Const.RAW_DATA_DIR, self.selected_file.value)
+        crop = self.radio_selections[-1][1].value
+        return self.iter_raw_download(path, crop)
+
+    def iter_raw_download(self, path, crop):
+        """ Generate the chunks of the raw download of path, the crop extracted from its store if it has one """
+        if not has_store(path, Const.CHUNKED_DATA_DIR):
+            yield from file_chunks(path)
+            return
+        # removed once the download is complete or cancelled
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp, "extract.nc4")
+            extract_crop(path, crop, dest, Const.CHUNKED_DATA_DIR)
+            yield from file_chunks(dest)
+
+    def get_aggregation_key(self, f, crop, op, region_map, weight_map):
+        """ Get the key of the aggregation result in Const.AGGREGATED_CACHE_DIR, None if any input is missing """
+        try:
+            return aggregation_key(os.path.join(Const.RAW_DATA_DIR, f), region_map, weight_map, crop, op,
+                                   engine=Const.AGGREGATION_ENGINE)
+        except OSError:
+            return None
@@ -2,16 +2,21 @@
 # rcampbel@purdue.edu - 2020-07-14
 
 import os
+import html
+import json
 import ipywidgets as widgets
-from ipyleaflet import Map, Marker, Popup, WidgetControl, Choropleth
+from ipyleaflet import Map, Marker, Popup, WidgetControl, GeoJSON
 from IPython.display import HTML, display, clear_output, FileLink
 import logging
-from branca.colormap import linear
 from lib.python.prop import displayable
-from lib.python.utils import get_dir_content, DownloadButton, get_colormap, is_float, zipped, conditional_widget, get_citation, remap_dict_keys, labeled_widget, hbox_scattered
-import matplotlib.pyplot as plt
+from lib.python.utils import get_dir_content, get_file_content, DownloadButton, is_float, zipped, conditional_widget, get_citation, remap_dict_keys, labeled_widget, hbox_scattered, legend_html, get_statistics_colormap, get_colors
 import numpy as np
 from lib.python.upload import SelectOrUpload
+from lib.python import cache
+from lib.python.startup import lazy_import, timed
+
+# only needed to plot a time series
+plt = lazy_import("matplotlib.pyplot")
 
 
 class View:
@@ -20,8 +25,8 @@ class View:
         # The view's "public" attributes are listed here, with type hints, for
         # quick reference
         self.aggregate_btn: widgets.Button
-        self.colormap: branca.colormap.LinearColormap
 
+    @timed("View.start")
     def start(self, log=False):
         """Build the user interface."""
 
@@ -66,9 +71,6 @@ class View:
         log = self.section("Log", [log_handler.log_output_widget])
 
 
-        # initialize placeholders
-        self.colormap = get_colormap()
-
         # Show the app
         header = widgets.HBox([app_title, logo])
         header.layout.justify_content = 'space-between'  # Example of custom widget layout
@@ -143,6 +145,10 @@ class View:
             )
             for category in Const.DATA_CATEGORIES
         ]
+        for i, radio in enumerate(self.radios):
+            radio._widget.add_class(f"agmip-radio-{i}")
+        # greys out the options without a file, see get_unavailable_options_style
+        self.radio_styles = widgets.HTML()
 
         self.radio_layout = widgets.GridspecLayout(2, 3)
         self.radio_layout[:, 0] = self.radios[0]
@@ -167,11 +173,11 @@ class View:
         # download button
         self.raw_download_btn = DownloadButton(
             filename="unnamed.RData",
-            contents=lambda: open(os.path.join(Const.RAW_DATA_DIR, model.selected_file.value), "rb").read(),
+            contents=model.get_raw_download,
             description='Download')
 
         # multiselect
-        self.folder_file_multi_select = widgets.SelectMultiple(options=[], description='Select files')
+        self.folder_file_multi_select = widgets.SelectMultiple(options=[], description='Select files', rows=10)
         self.select_all = widgets.Checkbox(
             value=True,
             description='Select All Available Files',
@@ -185,12 +191,21 @@ class View:
             self.section(
                 "Data Selection", [
                     labeled_widget(self.radio_layout, "Select Model-Crop Combinations"),
+                    self.radio_styles,
                     labeled_widget(displayable(model.selected_file), "Selected File"),
+                    labeled_widget(displayable(model.selected_file_metadata), "Selected File Info"),
                     hbox_scattered(
                         self.selection_previous_btn,
                         self.raw_download_btn,
                         self.selection_next_btn,
                     )]),
+            self.section(
+                "Ensemble Selection", [
+                    widgets.HTML("Crop model and GCM combinations available for the selected scenario, "
+                                 "to be aggregated together with <b>Aggregate Ensemble</b>."),
+                    self.select_all,
+                    self.folder_file_multi_select,
+                ], collapsed=True),
         ]
 
         return widgets.VBox(content)
@@ -224,12 +239,24 @@ class View:
             { 'option': self.aggregation_options.value }
         )+Const.REFERENCES).encode('utf-8'))
 
+        self.ensemble_aggregate_btn = widgets.Button(description="Aggregate Ensemble")
+        self.ensemble_download_btn = DownloadButton(
+            filename="ensemble.csv",
+            contents=lambda: cache.csv_chunks(model.ensemble_file.value),
+            description='Download Ensemble')
+
+        # progress of a running aggregation, hidden when there is none
+        self.aggregation_progress = widgets.FloatProgress(value=0, min=0, max=1, description="")
+        self.aggregation_cancel_btn = widgets.Button(description="Cancel")
+        self.aggregation_progress_box = widgets.HBox([self.aggregation_progress, self.aggregation_cancel_btn],
+                                                     layout={'display': 'none'})
+
         self.aggregation_previous_btn = self.get_navigation_button("prev", "Previous")
         self.aggregation_next_btn = self.get_navigation_button("next", "Next")
-        # TODO: disable the button based on whether there is cache, read file from cache <2022-05-17, David Deng> #
+        # enabled whenever the current selection is in the aggregation cache, see model.aggregated_file
         self.aggregated_download_btn = DownloadButton(
             filename="unnamed.csv",
-            contents=lambda: open("out.csv", "rb").read(),
+            contents=lambda: cache.csv_chunks(model.aggregated_file.value),
             description='Download')
 
         content = [
@@ -261,6 +288,11 @@ class View:
                         self.citation_btn,
                         self.aggregation_next_btn,
                     ),
+                    hbox_scattered(
+                        self.ensemble_aggregate_btn,
+                        self.ensemble_download_btn,
+                    ),
+                    self.aggregation_progress_box,
                 ]),
         ]
 
@@ -273,16 +305,36 @@ class View:
 
 # create map
         self.map = Map(center=center, zoom=2)
+        self.map.add_class('agmip-map')
 
-        # placeholder
-        self.choro = Choropleth()
-        self.map.add_layer(self.choro)
-        # placeholder
-        self.cmcontrol = WidgetControl(widget=widgets.Output())
+        # the region layer shown on the map, one per level of detail, see show_regions
+        self.choro = None
+        self.region_layers = {}
+        self.region_click_handler = None
+
+        # legends of every year, see set_year_styles
+        self.legend = widgets.HTML()
+        self.legend.add_class('agmip-year-legends')
+        self.cmcontrol = WidgetControl(widget=self.legend, position="topright", transparent_bg=True)
         self.map.add_control(self.cmcontrol)
 
+        self.global_scale_checkbox = widgets.Checkbox(value=False, description="Same color scale for all years")
+
+        # the map follows the slider in the browser, the kernel handles its values at most
+        # every Const.YEAR_UPDATE_INTERVAL, see Controller.connect
         self.zoom_slider = widgets.IntSlider(description='Year')
-        zscontrol = WidgetControl(widget=self.zoom_slider, position="bottomleft", transparent_bg=True)
+        self.zoom_slider.add_class('agmip-year-slider')
+        # the year read by the script in custom.html, rather than the formatted readout of the slider
+        self.year_value = widgets.IntText(layout={'display': 'none'})
+        self.year_value.add_class('agmip-year')
+        widgets.jslink((self.zoom_slider, 'value'), (self.year_value, 'value'))
+        # steps through the years in the browser, where the styles of every year already are
+        self.play = widgets.Play(interval=int(1000 / Const.MAP_FRAME_RATE), description="Play")
+        widgets.jslink((self.play, 'value'), (self.zoom_slider, 'value'))
+        widgets.jslink((self.zoom_slider, 'min'), (self.play, 'min'))
+        widgets.jslink((self.zoom_slider, 'max'), (self.play, 'max'))
+        zscontrol = WidgetControl(widget=widgets.HBox([self.play, self.zoom_slider, self.year_value]),
+                                  position="bottomleft", transparent_bg=True)
         self.map.add_control(zscontrol)
 
         # time series graph
@@ -297,61 +349,128 @@ class View:
 
         self.time_series = widgets.interactive_output(plot, {'info': model.time_series_info})
 
+        # the info panels are only evaluated while this section is open, see Model.visualize_info_visible
+        self.visualize_info = self.section("Info", [
+            hbox_scattered(
+                labeled_widget(displayable(model.radio_selections_info), "Crop Model Selection"),
+                widgets.VBox([
+                    labeled_widget(displayable(model.selected_info), "Selected Country Info"),
+                    labeled_widget(self.time_series, "Time Series Trend"),
+                ]),
+                labeled_widget(displayable(model.summary_info), "Summary Statistics"),
+            )
+        ], collapsed=True)
+
         content = [
-            self.section("Info", [
-                hbox_scattered(
-                    labeled_widget(displayable(model.radio_selections_info), "Crop Model Selection"),
-                    widgets.VBox([
-                        labeled_widget(displayable(model.selected_info), "Selected Country Info"),
-                        labeled_widget(self.time_series, "Time Series Trend"),
-                    ]),
-                    labeled_widget(displayable(model.summary_info), "Summary Statistics"),
-                )
-            ], collapsed=True),
+            self.visualize_info,
             self.section("Map", [
+                self.global_scale_checkbox,
                 self.map,
                 self.get_navigation_button("prev", "Previous"),
             ]),
         ]
         return widgets.VBox(content)
 
-    def refresh_map_colormap(self):
-        # replace the colormap legend control
-        self.map.remove_control(self.cmcontrol)
-        cm = widgets.Output()
-        cm.append_display_data(self.colormap)
-        self.cmcontrol = WidgetControl(widget=cm, position="topright", transparent_bg=True)
-        self.map.add_control(self.cmcontrol)
+    def get_unavailable_options_style(self, unavailable):
+        """ a style element greying out options of the radio buttons
 
-    def refresh_map_choro(self, choro_data):
-        data = list(choro_data.values())
-        self.colormap = get_colormap(data)
+        :unavailable: [[index, ...], ...] the options of each radio button to grey out, see Model.get_unavailable_options
+        """
+        selectors = [ f".agmip-radio-{i} .widget-radio-box label:nth-child({k + 1})"
+                      for i, indices in enumerate(unavailable or []) for k in indices ]
+        if not selectors:
+            return ""
+        return f"<style>{', '.join(selectors)} {{ opacity: 0.4; }}</style>"
 
-        with self.choro.hold_trait_notifications():
-            self.choro.colormap = self.colormap
-            self.choro.choro_data = choro_data.copy()
+    def show_aggregation_progress(self, label=None, fraction=0.0, cancellable=True):
+        """ show the progress of a running aggregation, hide it when label is None
 
-    def reset_map_choro(self, dict_data):
-        # similar to refresh_map_choro, except will recreate a new Choropleth object
-        # used on initial rendering of the map.
-        if dict_data is None:
-            logger.info("new data is empty, not resetting map")
+        :fraction: the overall progress, None to keep the current one
+        :cancellable: whether the aggregation can be cancelled in its current stage
+        """
+        if label is None:
+            self.aggregation_progress_box.layout.display = 'none'
+            self.aggregate_btn.disabled = False
+            self.ensemble_aggregate_btn.disabled = False
             return
+        self.aggregation_progress_box.layout.display = ''
+        self.aggregate_btn.disabled = True
+        self.ensemble_aggregate_btn.disabled = True
+        self.aggregation_cancel_btn.disabled = not cancellable
+        self.aggregation_progress.description = label
+        if fraction is not None:
+            self.aggregation_progress.value = fraction
 
-        data = list(dict_data.values())
-        self.colormap = get_colormap(data)
+    def set_year_styles(self, cube, global_scale=False):
+        """ send the colors and legends of every year of the cube to the browser at once
 
-        # first remove the old layer.
-        self.map.remove_layer(self.choro)
+        While the year slider is dragged, the script in custom.html switches the legend
+        and colors the regions with a style sheet, by the classes of their paths, see
+        get_region_layer. The region layers themselves aren't changed.
 
-        # create a new choropleth layer
-        self.choro = Choropleth(
-            geo_data=model.geodata,
-            choro_data=dict_data,
-            colormap=self.colormap,
-            hover_style={'color': 'white', 'dashArray': '0', 'fillOpacity': 0.5},
-            style={'fillOpacity': 0.8, 'dashArray': '5, 5'},
-            border_color='black',
-        )
+        :cube: a RegionCube whose regions are the features of model.geodata
+        :global_scale: whether to use the same color scale for all years, so that
+            colors can be compared across time, instead of a scale per year
+
+        """
+        if global_scale:
+            colormaps = [get_statistics_colormap(cube.year_statistics(None, global_scale=True))] * len(cube.years)
+        else:
+            colormaps = [ get_statistics_colormap(cube.year_statistics(year)) for year in cube.years.tolist() ]
+        colors = [ get_colors(colormap, row) for colormap, row in zip(colormaps, cube.values) ]
+        legends = [ legend_html(colormap, year, hidden=i > 0)
+                    for i, (year, colormap) in enumerate(zip(cube.years.tolist(), colormaps)) ]
+        styles = {
+            'start': cube.years[0].item() if len(cube.years) else 0,
+            'colors': colors,
+            'opacity': Const.MAP_REGION_OPACITY,
+            'nan_color': Const.MAP_NAN_COLOR,
+            'nan_opacity': Const.MAP_NAN_OPACITY,
+        }
+        self.legend.value = (f'<div class="agmip-year-styles" data-styles="{html.escape(json.dumps(styles))}">'
+                             + "".join(legends) + '</div>')
+
+    def get_region_layer(self, tolerance):
+        """ the layer of the regions simplified with tolerance, created once per session
+
+        The layer is never restyled from the kernel, so its geometry is only sent to the
+        browser once. The path of each region is tagged with its index in model.geodata,
+        for the style sheet of the script in custom.html to color it. Without the script,
+        the regions keep the fill of missing values.
+
+        """
+        if tolerance not in self.region_layers:
+            geodata = model.get_geodata(tolerance)
+            features = [ {**feature, 'properties': {**feature['properties'], 'style': {
+                             'className': f"agmip-region-{i}",
+                         }}} for i, feature in enumerate(geodata['features']) ]
+            layer = GeoJSON(
+                data={**geodata, 'features': features},
+                hover_style={'color': 'white', 'dashArray': '0', 'fillOpacity': 0.5},
+                style={'color': 'black', 'weight': 0.9, 'dashArray': '5, 5',
+                       'fillColor': Const.MAP_NAN_COLOR, 'fillOpacity': Const.MAP_NAN_OPACITY},
+            )
+            if self.region_click_handler is not None:
+                layer.on_click(self.region_click_handler)
+            self.region_layers[tolerance] = layer
+        return self.region_layers[tolerance]
+
+    def on_region_click(self, callback):
+        """ register the callback of a click on a region, for every level of detail """
+        self.region_click_handler = callback
+        for layer in self.region_layers.values():
+            layer.on_click(callback)
+
+    def show_regions(self, zoom=None):
+        """ show the region layer with the level of detail of the zoom, see Const.GEODATA_LEVELS """
+        zoom = self.map.zoom if zoom is None else zoom
+        tolerance = next(tolerance for max_zoom, tolerance in Const.GEODATA_LEVELS
+                         if max_zoom is None or zoom <= max_zoom)
+        layer = self.get_region_layer(tolerance)
+        if layer is self.choro:
+            return
+        if self.choro is not None:
+            self.map.remove_layer(self.choro)
+        self.choro = layer
         self.map.add_layer(self.choro)
 
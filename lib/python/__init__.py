@@ -1 +1 @@
-from .prop import Prop, SyncedProp, ComputedProp
+from .prop import Prop, SyncedProp, ComputedProp, PropScope, batch, temporary_props
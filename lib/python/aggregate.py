@@ -0,0 +1,378 @@
+""" In-process aggregation of gridded AgMIP yields to regions.
+
+Mirrors grid.agg in lib/rfunctions/agmip.fns.r for the 'st' (summary statistics)
+and 'wa' (weighted average) options, but works on the 720x360 grid directly:
+every grid cell is mapped to an integer region code, and the aggregation is a
+grouped reduction over (region code, year).
+"""
+import csv
+import json
+import os
+import shutil
+import warnings
+import numpy as np
+from .gridmap import load_region_map, load_weight_map
+from .rawdata import START_YEAR, read_yields
+from .jobs import no_progress
+
+# bump whenever a change to the engine changes its results, to invalidate cached results
+ENGINE_VERSION = "2"
+
+# 'st' for summary statistics, 'wa' for weighted average
+OPTIONS = ("st", "wa")
+SUMMARY_COLUMNS = ["mean", "median", "sd", "min", "pctle25", "pctle75", "max"]
+WEIGHTED_AVERAGE_COLUMN = "w.ave.yield"
+
+# layout of the directories written by AggregationResult.save
+RESULT_META = "meta.json"
+RESULT_VERSION = 1
+
+
+class AggregationResult:
+    """ Aggregated values in long format, one row per (region, year),
+    ordered by region id and then by year, like the output of grid.agg.
+    """
+
+    def __init__(self, ids, region, time, columns):
+        """ initializer.
+
+        :ids: array of region ids, indexed by region code
+        :region: region code of each row
+        :time: year of each row
+        :columns: { name: values, ... }, one value per row for each aggregated variable
+
+        """
+        self.ids = ids
+        self.region = region
+        self.time = time
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.time)
+
+    def to_csv(self, path):
+        """ write the result in the format of R's write.csv """
+        with open(path, 'w') as f:
+            f.write(self.csv())
+
+    def csv(self):
+        """ the result in the format of R's write.csv, as a string """
+        return "".join(self.iter_csv())
+
+    def iter_csv(self, rows_per_chunk=50000):
+        """ the result in the format of R's write.csv, as strings of at most rows_per_chunk lines,
+        to stream it without holding all of it in memory """
+        yield ",".join(f'"{name}"' for name in ["", "id", "time", *self.columns]) + "\n"
+        for start in range(0, len(self), rows_per_chunk):
+            end = start + rows_per_chunk
+            rows = zip(self.ids[self.region[start:end]], self.time[start:end],
+                       *(values[start:end] for values in self.columns.values()))
+            yield "".join(f'"{i}","{rid}",{year},' + ",".join(format_value(v) for v in values) + "\n"
+                          for i, (rid, year, *values) in enumerate(rows, start=start + 1))
+
+    def save(self, path, info=None):
+        """ store the result as a directory of .npy files, see load
+
+        The region ids are stored once, as a categorical column: ids.npy holds the
+        ids and region.npy the int32 code of each row. The directory appears atomically.
+
+        :info: a JSON-serializable dict describing how the result was computed, stored in meta.json
+
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        arrays = {
+            "ids": np.asarray(self.ids, dtype=str),
+            "region": np.asarray(self.region, dtype=np.int32),
+            "time": np.asarray(self.time, dtype=np.int32),
+        }
+        arrays.update((f"column{i}", np.asarray(values, dtype=np.float64))
+                      for i, values in enumerate(self.columns.values()))
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), array)
+        # written last, a directory with meta.json is complete
+        with open(os.path.join(tmp, RESULT_META), 'w') as f:
+            meta = { "version": RESULT_VERSION, "columns": list(self.columns), "rows": len(self) }
+            if info is not None:
+                meta["info"] = info
+            json.dump(meta, f)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # already saved by someone else
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(path, RESULT_META)):
+                raise
+
+    @classmethod
+    def load(cls, path):
+        """ load a result stored with save, memory-mapping its arrays """
+        with open(os.path.join(path, RESULT_META), 'r') as f:
+            meta = json.load(f)
+        array = lambda name: np.load(os.path.join(path, name + ".npy"), mmap_mode='r')
+        return cls(ids=array("ids"),
+                   region=array("region"),
+                   time=array("time"),
+                   columns={ name: array(f"column{i}") for i, name in enumerate(meta["columns"]) })
+
+    @classmethod
+    def read_csv(cls, path):
+        """ read a result written by R's write.csv, e.g. by lib/rfunctions/worker.r """
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            names = next(reader)[3:]
+            rows = list(reader)
+        rids = np.array([row[1] for row in rows], dtype=str)
+        ids, region = np.unique(rids, return_inverse=True)
+        values = np.array([[np.nan if v == "NA" else float(v) for v in row[3:]] for row in rows],
+                          dtype=np.float64).reshape(len(rows), len(names))
+        return cls(ids=ids,
+                   region=region.astype(np.int32),
+                   time=np.array([int(row[2]) for row in rows], dtype=np.int32),
+                   columns={ name: values[:, i] for i, name in enumerate(names) })
+
+def format_value(v):
+    """ format a float the way R's write.csv does, NA for missing values """
+    return f"{v:.15g}" if np.isfinite(v) else "NA"
+
+
+def group_summary(group, values, ngroups, progress=no_progress):
+    """ compute mean, median, sd, min, 25th and 75th percentiles and max per group
+
+    All groups are summarized at once: a single sort by (group, value) makes each
+    group a sorted contiguous segment, from which the order statistics are read
+    at fixed offsets.
+
+    :group: group index of each value
+    :values: the values to summarize
+    :ngroups: total number of groups
+    :progress: progress callback, see jobs.Job
+    :returns: { name: array of length ngroups, ... }, NaN for empty groups
+
+    """
+    # sort by value, then stably by group: faster than np.lexsort for the same order
+    order = np.argsort(values)
+    order = order[np.argsort(group[order], kind='stable')]
+    group, values = group[order], values[order]
+    progress("reduce", 0.5)
+    counts = np.bincount(group, minlength=ngroups)
+    nonempty = np.flatnonzero(counts)
+    n = counts[nonempty]
+    starts = np.cumsum(n) - n
+    ends = starts + n - 1
+
+    stats = { name: np.full(ngroups, np.nan) for name in SUMMARY_COLUMNS }
+    mean = np.add.reduceat(values, starts) / n
+    # two passes like R's var
+    squares = np.add.reduceat((values - np.repeat(mean, n)) ** 2, starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats["sd"][nonempty] = np.where(n > 1, np.sqrt(squares / (n - 1)), np.nan)
+    stats["mean"][nonempty] = mean
+    stats["min"][nonempty] = values[starts]
+    stats["max"][nonempty] = values[ends]
+    for name, p in (("pctle25", 0.25), ("median", 0.5), ("pctle75", 0.75)):
+        stats[name][nonempty] = segment_quantile(values, starts, n, p)
+    progress("reduce", 1.0)
+    return stats
+
+def segment_quantile(values, starts, n, p):
+    """ R's type 7 quantile of sorted segments of values
+
+    :values: values, sorted within each segment
+    :starts: the start of each segment
+    :n: the length of each segment, at least 1
+    :p: the probability
+    :returns: an array with the quantile of each segment
+
+    """
+    index = (n - 1) * p
+    lo = np.floor(index).astype(np.intp)
+    hi = np.minimum(lo + 1, n - 1)
+    h = index - lo
+    x_lo, x_hi = values[starts + lo], values[starts + hi]
+    # interpolate like quantile.default, only where it changes the result
+    interpolate = (h > 0) & (x_hi != x_lo)
+    return np.where(interpolate, (1 - h) * x_lo + h * x_hi, x_lo)
+
+def weighted_average(values, valid, region, weights):
+    """ weighted mean of the valid values per (region, year), computed as
+    masked dot products over the contiguous segment of cells of each region
+
+    :values: array of shape (year, cell), the cells being ordered by region
+    :valid: boolean array of the same shape, False for missing values
+    :region: the sorted region code of each cell
+    :weights: the weight of each cell
+    :returns: (regions, average, present), the region codes having at least one cell,
+        and two arrays of shape (region, year): the weighted averages, and whether
+        the region has any valid value in that year
+
+    """
+    starts = np.flatnonzero(np.r_[True, region[1:] != region[:-1]])
+    w = np.where(valid, weights.astype(np.float64), 0)
+    numerator = np.add.reduceat(np.where(valid, values, 0) * w, starts, axis=1)
+    denominator = np.add.reduceat(w, starts, axis=1)
+    present = np.logical_or.reduceat(valid, starts, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # like R's weighted.mean, NaN when all weights are 0
+        average = numerator / denominator
+    return region[starts], average.T, present.T
+
+def join(codes, option, weights=None):
+    """ select and order the grid cells taking part in an aggregation, the left joins of grid.agg
+
+    :codes: region code grid as returned by load_region_map
+    :option: 'st' or 'wa'
+    :weights: (weights, mask) as returned by load_weight_map, required for 'wa'
+    :returns: (cells, region, cell_weights): the flat indices of the cells ordered by region,
+        so that each region is a contiguous segment, their region codes, and their weights
+        (None unless option is 'wa')
+
+    """
+    if option not in OPTIONS:
+        raise ValueError(f"Invalid aggregation option: {option}. Option must be one of {OPTIONS}")
+    if option == 'wa' and weights is None:
+        raise ValueError("A weight map is required for the weighted average")
+    cell_codes = codes.ravel()
+    # left join with the region map, drop cells outside any region
+    joined = cell_codes >= 0
+    if option == 'wa':
+        # left join with the weight map, drop cells without weights
+        joined &= weights[1].ravel()
+    cells = np.flatnonzero(joined)
+    cells = cells[np.argsort(cell_codes[cells], kind='stable')]
+    cell_weights = weights[0].ravel()[cells] if option == 'wa' else None
+    return cells, cell_codes[cells].astype(np.intp), cell_weights
+
+def aggregate(data, codes, ids, option, weights=None, start_year=START_YEAR, progress=no_progress, joined=None):
+    """ aggregate gridded data to regions, equivalent to grid.agg
+
+    :data: array of shape (year, lat, lon), NaN for missing values
+    :codes: region code grid as returned by load_region_map
+    :ids: region ids as returned by load_region_map
+    :option: 'st' for summary statistics or 'wa' for weighted average
+    :weights: (weights, mask) as returned by load_weight_map, required for 'wa'
+    :start_year: the year of data[0]
+    :progress: progress callback, see jobs.Job
+    :joined: the result of join(codes, option, weights), to share it between aggregations
+    :returns: an AggregationResult
+
+    """
+    progress("join", 0.0)
+    cells, region, cell_weights = join(codes, option, weights) if joined is None else joined
+    nyears = data.shape[0]
+    cell_values = data.reshape(nyears, -1)[:, cells]
+    valid = ~np.isnan(cell_values)
+    progress("reduce", 0.0)
+
+    if len(cells) == 0:
+        empty = np.array([], dtype=np.intp)
+        columns = SUMMARY_COLUMNS if option == 'st' else [WEIGHTED_AVERAGE_COLUMN]
+        return AggregationResult(ids, empty, empty, { name: np.array([]) for name in columns })
+
+    if option == 'wa':
+        regions, average, present = weighted_average(cell_values, valid, region, cell_weights)
+        r, t = np.nonzero(present)
+        return AggregationResult(
+            ids=ids,
+            region=regions[r],
+            time=start_year + t,
+            columns={ WEIGHTED_AVERAGE_COLUMN: average[r, t] })
+
+    # one group per (region, year), numbered in (id, time) order
+    group = region[None, :] * nyears + np.arange(nyears)[:, None]
+    group, cell_values = group[valid], cell_values[valid]
+    ngroups = len(ids) * nyears
+    columns = group_summary(group, cell_values, ngroups, progress)
+
+    present = np.flatnonzero(np.bincount(group, minlength=ngroups) > 0)
+    return AggregationResult(
+        ids=ids,
+        region=present // nyears,
+        time=start_year + present % nyears,
+        columns={ name: col[present] for name, col in columns.items() })
+
+def aggregate_file(path, crop, option, region_map, weight_map=None, start_year=START_YEAR, store_dir=None,
+                   progress=no_progress):
+    """ read a RData file and aggregate one of its crops, equivalent to agg.wrapper in do.r
+
+    :path: path to the RData file
+    :crop: one of rawdata.CROP_NAMES
+    :option: 'st' or 'wa'
+    :region_map: path to the region map csv
+    :weight_map: path to the weight map csv, only used for 'wa'
+    :store_dir: directory of the chunked stores, see rawdata.read_yields
+    :progress: progress callback, see jobs.Job, reporting the 'read', 'join' and 'reduce' stages
+    :returns: an AggregationResult
+
+    """
+    codes, ids = load_region_map(region_map)
+    weights = load_weight_map(weight_map) if option == 'wa' else None
+    data = read_yields(path, crop, store_dir=store_dir, progress=progress)
+    return aggregate(data, codes, ids, option, weights, start_year, progress=progress)
+
+
+ENSEMBLE_STATISTICS = ["mean", "median", "sd", "min", "max"]
+ENSEMBLE_PREFIX = "ensemble."
+
+def primary_column(option):
+    """ the column of an AggregationResult that summarizes each region, see Const.PRIMARY_VAR """
+    return "mean" if option == 'st' else WEIGHTED_AVERAGE_COLUMN
+
+def member_label(path):
+    """ the name of an ensemble member, e.g. lpjml_gfdl-esm4_ssp585 """
+    return os.path.splitext(os.path.basename(path))[0].replace("_default_production_and_yield_grid", "")
+
+def combine_ensemble(members, column):
+    """ combine the results of several ensemble members into ensemble statistics
+
+    :members: { label: AggregationResult, ... }, aggregated with the same region map
+    :column: the column of each member to combine
+    :returns: an AggregationResult with a row for every (region, year) of any member, and columns
+        ensemble.mean, ensemble.median, ensemble.sd, ensemble.min, ensemble.max and one per member,
+        the statistics being computed over the members that have a value
+
+    """
+    results = list(members.values())
+    ids = results[0].ids
+    # a unique, sortable key per (region, year)
+    keys = [ result.region.astype(np.int64) * 10000 + result.time for result in results ]
+    rows = np.unique(np.concatenate(keys))
+    matrix = np.full((len(results), len(rows)), np.nan)
+    for i, (result, key) in enumerate(zip(results, keys)):
+        matrix[i, np.searchsorted(rows, key)] = result.columns[column]
+
+    with warnings.catch_warnings():
+        # all-NaN slices and single members are expected, and give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        statistics = {
+            "mean": np.nanmean(matrix, axis=0),
+            "median": np.nanmedian(matrix, axis=0),
+            "sd": np.nanstd(matrix, axis=0, ddof=1),
+            "min": np.nanmin(matrix, axis=0),
+            "max": np.nanmax(matrix, axis=0),
+        }
+    columns = { ENSEMBLE_PREFIX + name: statistics[name] for name in ENSEMBLE_STATISTICS }
+    columns.update(zip(members, matrix))
+    return AggregationResult(ids=ids, region=rows // 10000, time=rows % 10000, columns=columns)
+
+def aggregate_ensemble(paths, crop, option, region_map, weight_map=None, start_year=START_YEAR, store_dir=None,
+                       progress=no_progress):
+    """ aggregate the same crop of several RData files, and combine them with combine_ensemble
+
+    The region map, the weight map and their join with the grid are only computed once.
+
+    :paths: paths to the RData files
+    :returns: an AggregationResult, see combine_ensemble
+
+    """
+    codes, ids = load_region_map(region_map)
+    weights = load_weight_map(weight_map) if option == 'wa' else None
+    joined = join(codes, option, weights)
+    members = {}
+    for i, path in enumerate(paths):
+        member_progress = lambda stage, fraction=0.0: progress("load" if stage == "load" else "reduce", i / len(paths))
+        data = read_yields(path, crop, store_dir=store_dir, progress=member_progress)
+        members[member_label(path)] = aggregate(data, codes, ids, option, weights, start_year,
+                                                progress=member_progress, joined=joined)
+    progress("reduce", 1.0)
+    return combine_ensemble(members, primary_column(option))
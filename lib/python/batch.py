@@ -0,0 +1,149 @@
+""" Headless batch aggregation into the aggregation cache.
+
+Aggregates every available combination of crop model, GCM, scenario and crop
+matching the filters, skipping the ones that are already cached, e.g.
+
+    python -m lib.python.batch --region-map data/regionmap/WorldId.csv --option st
+    python -m lib.python.batch --region-map data/regionmap/WorldId.csv --option wa \\
+        --weight-map data/weightmap/tea_hectares_30min.csv --model lpjml --scenario ssp585 --crop maize
+
+Each RData file is handled by one process of a pool, which reads the file
+once for all of its crops.
+"""
+import argparse
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import cache, paths
+from .aggregate import OPTIONS, aggregate
+from .catalog import Catalog
+from .gridmap import load_region_map, load_weight_map
+from .metadata import MetadataIndex
+from .rawdata import CROP_NAMES, iter_crops
+
+# the memory used by a worker process: the arrays of a whole RData file, ~2.6 GB, and the aggregation
+WORKER_MEMORY = 3 * 2**30
+
+
+def default_workers(worker_memory=WORKER_MEMORY):
+    """ the number of worker processes fitting in the processors and the available memory of the machine """
+    workers = os.cpu_count() or 1
+    try:
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        # not reported, e.g. on macOS or Windows: a conservative fixed cap
+        return min(workers, 4)
+    return max(1, min(workers, available // worker_memory))
+
+def find_tasks(raw_dir, models, gcms, scenarios, crops):
+    """ list the existing RData files matching the filters
+
+    :models, gcms, scenarios: the values to keep, None for all
+    :returns: a list of (path, crops), sorted by (model, gcm, scenario)
+
+    """
+    entries = Catalog(raw_dir).entries()
+    return [ (os.path.join(raw_dir, entry.name), crops)
+             for (model, gcm, scenario), entry in sorted(entries.items())
+             if (models is None or model in models) and (gcms is None or gcm in gcms)
+             and (scenarios is None or scenario in scenarios) ]
+
+def aggregate_crops(path, crops, keys, option, region_map, weight_map, cache_dir, store_dir):
+    """ aggregate several crops of a RData file into the cache, run in a worker process
+
+    :keys: { crop: cache key, ... }
+    :returns: a list of (crop, rows, nbytes, error), nbytes being the size of the yield grid
+        aggregated, and error None or a formatted traceback
+
+    """
+    codes, ids = load_region_map(region_map)
+    weights = load_weight_map(weight_map) if option == 'wa' else None
+    done = []
+    try:
+        for crop, data in iter_crops(path, crops, store_dir=store_dir):
+            try:
+                result = aggregate(data, codes, ids, option, weights)
+                info = cache.aggregation_info(path, region_map, weight_map, crop, option)
+                cache.save(result, cache_dir, keys[crop], info)
+                done.append((crop, len(result), data.nbytes, None))
+            except Exception:
+                done.append((crop, 0, data.nbytes, traceback.format_exc()))
+    except Exception:
+        # the file itself couldn't be read
+        handled = { crop for crop, _, _, _ in done }
+        done += [ (crop, 0, 0, traceback.format_exc()) for crop in crops if crop not in handled ]
+    return done
+
+def main(argv=None):
+    """ aggregate the GGCM x GCM x RCP x crop matrix into the aggregation cache """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--region-map", required=True, help="path to the region map csv")
+    parser.add_argument("--option", required=True, choices=OPTIONS)
+    parser.add_argument("--weight-map", help="path to the weight map csv, required for 'wa'")
+    parser.add_argument("--model", action="append", help="crop model, repeatable, default all files")
+    parser.add_argument("--gcm", action="append", help="GCM, repeatable, default all files")
+    parser.add_argument("--scenario", action="append", help="scenario, repeatable, default all files")
+    parser.add_argument("--crop", action="append", choices=CROP_NAMES, help="crop, repeatable, default all")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="size of the process pool, each process holding a whole RData file in memory "
+                             f"(~{WORKER_MEMORY / 2**30:.0f} GB). Defaults to the number of processors, "
+                             "at most the available memory divided by that size")
+    parser.add_argument("--raw-dir", default=paths.RAW_DATA_DIR)
+    parser.add_argument("--cache-dir", default=paths.AGGREGATED_CACHE_DIR)
+    parser.add_argument("--store-dir", default=paths.CHUNKED_DATA_DIR)
+    parser.add_argument("--metadata-index", default=paths.METADATA_INDEX,
+                        help="the metadata index updated with the new aggregations, see lib/python/metadata.py")
+    args = parser.parse_args(argv)
+    if args.option == 'wa' and args.weight_map is None:
+        parser.error("--weight-map is required for the 'wa' option")
+
+    # compile the maps once, the workers memory-map the compiled files
+    load_region_map(args.region_map)
+    if args.option == 'wa':
+        load_weight_map(args.weight_map)
+
+    pending, skipped = [], 0
+    for path, crops in find_tasks(args.raw_dir, args.model, args.gcm, args.scenario, args.crop or CROP_NAMES):
+        keys = { crop: cache.aggregation_key(path, args.region_map, args.weight_map, crop, args.option)
+                 for crop in crops }
+        todo = [ crop for crop in crops if cache.lookup(args.cache_dir, keys[crop]) is None ]
+        skipped += len(crops) - len(todo)
+        if todo:
+            pending.append((path, todo, keys))
+    total = sum(len(todo) for _, todo, _ in pending)
+    print(f"{total} aggregations in {len(pending)} files, {skipped} already cached")
+
+    start = time.time()
+    # the size of the yield grids aggregated, whether read from the RData files or their stores
+    done = failed = rows = nbytes = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = { pool.submit(aggregate_crops, path, todo, keys, args.option, args.region_map,
+                                args.weight_map, args.cache_dir, args.store_dir): path
+                    for path, todo, keys in pending }
+        for future in as_completed(futures):
+            path = futures[future]
+            for crop, n, size, error in future.result():
+                nbytes += size
+                if error is None:
+                    done += 1
+                    rows += n
+                else:
+                    failed += 1
+                    print(f"{os.path.basename(path)} {crop} failed:\n{error}", file=sys.stderr)
+            print(f"[{done + failed}/{total}] {os.path.basename(path)}")
+
+    elapsed = time.time() - start
+    if done:
+        indexed, _ = MetadataIndex(args.metadata_index).update('aggregation', args.cache_dir)
+        print(f"{indexed} aggregations indexed in {args.metadata_index}")
+    print(f"{done} aggregated, {failed} failed, {skipped} skipped in {elapsed:.1f}s "
+          f"with {args.workers} workers")
+    if done + failed:
+        print(f"{(done + failed) / elapsed:.2f} aggregations/s, {rows / elapsed:.0f} rows/s, "
+              f"{nbytes / elapsed / 2**20:.1f} MB/s of yield grids")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+""" Content-addressed cache of aggregation results.
+
+A result is stored under a key derived from everything it depends on: the
+identity of the input file, the content of the region map and weight map,
+the crop, the aggregation option and the version of the engine. Identical
+requests from any user are served from disk.
+
+Results are stored in the binary layout of AggregationResult.save, and loaded
+memory-mapped with load. CSV is only produced for downloads, see csv_chunks.
+"""
+import hashlib
+import json
+import os
+from .aggregate import ENGINE_VERSION, RESULT_META, AggregationResult
+from .gridmap import region_map_hash, weight_map_hash
+
+RESULT_EXT = ".agg"
+
+
+def file_identity(path):
+    """ identify a raw data file by name, size and modification time, without reading it """
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def aggregation_key(input_file, region_map, weight_map, crop, option, engine='python'):
+    """ compute the cache key of an aggregation
+
+    :input_file: path to the raw data file
+    :region_map: path to the region map csv
+    :weight_map: path to the weight map csv, ignored unless option is 'wa'
+    :crop: the crop to aggregate
+    :option: the aggregation option
+    :engine: 'python' for lib/python/aggregate.py, 'r' for lib/rfunctions/worker.r
+    :returns: a hex digest
+
+    """
+    components = {
+        'input': file_identity(input_file),
+        'region_map': region_map_hash(region_map),
+        'weight_map': weight_map_hash(weight_map) if option == 'wa' else None,
+        'crop': crop,
+        'option': option,
+        'engine': ENGINE_VERSION if engine == 'python' else engine,
+    }
+    return hashlib.sha1(json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+
+def aggregation_info(input_file, region_map, weight_map, crop, option, engine='python'):
+    """ a readable description of an aggregation, stored with its result, see save
+
+    The parameters are those of aggregation_key. input_file can also be a list, for an ensemble.
+    """
+    inputs = input_file if isinstance(input_file, (list, tuple)) else [input_file]
+    return {
+        'inputs': [ os.path.basename(path) for path in inputs ],
+        'region_map': os.path.basename(region_map),
+        'weight_map': os.path.basename(weight_map) if option == 'wa' and weight_map else None,
+        'crop': crop,
+        'option': option,
+        'engine': engine,
+    }
+
+def ensemble_key(member_keys):
+    """ compute the cache key of an ensemble aggregation from the keys of its members """
+    components = {
+        'members': sorted(member_keys),
+        'engine': ENGINE_VERSION,
+    }
+    return hashlib.sha1(json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+
+def result_path(cache_dir, key):
+    return os.path.join(cache_dir, key + RESULT_EXT)
+
+def lookup(cache_dir, key):
+    """ path of the cached result, None if not cached """
+    path = result_path(cache_dir, key)
+    return path if os.path.exists(os.path.join(path, RESULT_META)) else None
+
+def read_meta(path):
+    """ the content of meta.json of a cached result, see AggregationResult.save """
+    with open(os.path.join(path, RESULT_META), 'r') as f:
+        return json.load(f)
+
+def load(path):
+    """ load a cached result, see lookup
+
+    :returns: an AggregationResult with memory-mapped columns
+
+    """
+    return AggregationResult.load(path)
+
+def csv_chunks(path):
+    """ the content of a cached result in the format of R's write.csv, as chunks of bytes, for streamed downloads """
+    for chunk in load(path).iter_csv():
+        yield chunk.encode('utf-8')
+
+def save(result, cache_dir, key, info=None):
+    """ store an AggregationResult in the cache
+
+    :info: the description of the aggregation, see aggregation_info
+    :returns: path of the cached result
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = result_path(cache_dir, key)
+    result.save(path, info)
+    return path
+
+def save_csv(src, cache_dir, key, info=None):
+    """ convert a result csv written by another engine into the cache, removing the csv
+
+    :returns: path of the cached result
+
+    """
+    path = save(AggregationResult.read_csv(src), cache_dir, key, info)
+    os.remove(src)
+    return path
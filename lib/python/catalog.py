@@ -0,0 +1,134 @@
+""" In-memory catalog of the raw data files.
+
+The raw data directory is a shared mount with hundreds of RData files, named
+after the crop model, GCM and scenario of their simulation:
+
+    acea_gfdl-esm4_ssp126_default_production_and_yield_grid.RData
+
+Rather than listing the directory on every selection, the files are listed
+once, parsed into CatalogEntry, and listed again only when the modification
+time of the directory changes, checked at most every poll_interval seconds.
+The catalog of a directory is shared by every session of the process, see
+get_catalog.
+"""
+import os
+import threading
+import time
+from typing import NamedTuple
+
+FILE_SUFFIX = "_default_production_and_yield_grid.RData"
+# the fields of the file names, in the order of Const.DATA_CATEGORIES
+FIELDS = ("model", "gcm", "scenario")
+
+
+class CatalogEntry(NamedTuple):
+    """ A raw data file """
+    name: str
+    model: str
+    gcm: str
+    scenario: str
+    size: int
+
+def file_name(model, gcm, scenario):
+    """ the name of the raw data file of a simulation """
+    return "_".join([model, gcm, scenario]) + FILE_SUFFIX
+
+def parse_file_name(name):
+    """ (model, gcm, scenario) of a raw data file name, None if it isn't one """
+    if not name.endswith(FILE_SUFFIX):
+        return None
+    fields = name[:-len(FILE_SUFFIX)].split("_")
+    return tuple(fields) if len(fields) == len(FIELDS) else None
+
+
+class Catalog:
+    """ The files of a directory, listed again when the directory changes """
+
+    def __init__(self, dirpath, poll_interval=30):
+        """ initializer.
+
+        :dirpath: the directory of the raw data files
+        :poll_interval: the minimum time between two checks of the directory, in seconds
+        :returns: None
+
+        """
+        self.dirpath = dirpath
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._checked = float('-inf')
+        self._mtime = None
+        # every file name, including those that aren't raw data files
+        self._names = frozenset()
+        # { (model, gcm, scenario): CatalogEntry, ... }
+        self._entries = {}
+
+    def refresh(self, force=False):
+        """ list the directory again if it changed since the last check
+
+        Files are added, removed and renamed in place, which updates the modification
+        time of the directory. Files rewritten in place are only seen with force.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._checked < self.poll_interval:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.dirpath).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if not force and mtime == self._mtime:
+                return
+            self._names, self._entries = self._scan() if mtime is not None else (frozenset(), {})
+            self._mtime = mtime
+
+    def _scan(self):
+        names, entries = set(), {}
+        with os.scandir(self.dirpath) as it:
+            for entry in it:
+                # the type comes with the listing, only raw data files are stat'ed, for their size
+                if not entry.is_file():
+                    continue
+                names.add(entry.name)
+                fields = parse_file_name(entry.name)
+                if fields is not None:
+                    entries[fields] = CatalogEntry(entry.name, *fields, entry.stat().st_size)
+        return frozenset(names), entries
+
+    def entries(self):
+        """ { (model, gcm, scenario): CatalogEntry, ... } of the raw data files """
+        self.refresh()
+        return self._entries
+
+    def __contains__(self, name):
+        self.refresh()
+        return name in self._names
+
+    def lookup(self, model, gcm, scenario):
+        """ the CatalogEntry of a simulation, None if there is no file for it """
+        return self.entries().get((model, gcm, scenario))
+
+    def scenario_files(self, scenario):
+        """ the sorted names of the files of a scenario, across all crop models and GCMs """
+        return sorted(entry.name for entry in self.entries().values() if entry.scenario == scenario)
+
+    def values(self, field, **fixed):
+        """ the values of field in the files matching the other fields given in fixed
+
+        e.g. values('model', gcm='gfdl-esm4', scenario='ssp126') is the set of crop models
+        with a file for that GCM and scenario. Fields that are None aren't fixed.
+        """
+        fixed = { FIELDS.index(k): v for k, v in fixed.items() if v is not None }
+        i = FIELDS.index(field)
+        return { key[i] for key in self.entries() if all(key[j] == v for j, v in fixed.items()) }
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(dirpath, poll_interval=30):
+    """ the Catalog of dirpath, shared by every caller in the process """
+    with _catalogs_lock:
+        if dirpath not in _catalogs:
+            _catalogs[dirpath] = Catalog(dirpath, poll_interval)
+        return _catalogs[dirpath]
@@ -0,0 +1,113 @@
+""" Aggregated values of one variable as a dense (year x region) array.
+
+The map, the summary statistics and the time series of a region all read
+slices of the same float32 array: a row per year, a column per region of the
+map, NaN where the aggregation has no value.
+"""
+import warnings
+from functools import cached_property
+import numpy as np
+
+QUARTILES = [0.25, 0.5, 0.75]
+
+
+def row_statistics(values):
+    """ summary statistics of each row of a 2D array, ignoring NaN
+
+    The quartiles are those of statistics.quantiles, numpy's 'weibull' method.
+
+    :values: array of shape (row, column)
+    :returns: { name: array of length row, ... }: count, min, max, sd, and the quartiles
+        q1, q2, q3 of the values, and pq1, pq2, pq3 of the positive values. NaN where undefined.
+
+    """
+    values = values.astype(np.float64)
+    positive = np.where(values > 0, values, np.nan)
+    with warnings.catch_warnings():
+        # all-NaN rows are expected, and give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        q1, q2, q3 = np.nanquantile(values, QUARTILES, axis=1, method='weibull')
+        pq1, pq2, pq3 = np.nanquantile(positive, QUARTILES, axis=1, method='weibull')
+        return {
+            "count": np.count_nonzero(~np.isnan(values), axis=1),
+            "positive_count": np.count_nonzero(~np.isnan(positive), axis=1),
+            "min": np.nanmin(values, axis=1),
+            "max": np.nanmax(values, axis=1),
+            "sd": np.nanstd(values, axis=1, ddof=1),
+            "q1": q1, "q2": q2, "q3": q3,
+            "pq1": pq1, "pq2": pq2, "pq3": pq3,
+        }
+
+
+class RegionCube:
+    """ Values of one variable for every year and region """
+
+    def __init__(self, years, regions, values):
+        """ initializer.
+
+        :years: the consecutive years of the rows
+        :regions: the region ids of the columns
+        :values: float32 array of shape (year, region), NaN for missing values
+
+        """
+        self.years = np.asarray(years)
+        self.regions = list(regions)
+        self.values = values
+        self.index = { region: i for i, region in enumerate(self.regions) }
+
+    @classmethod
+    def from_result(cls, result, column, regions):
+        """ arrange a column of an AggregationResult by year and region
+
+        :result: an AggregationResult
+        :column: the name of the column
+        :regions: the region ids of the columns, e.g. the ids of the map features.
+            Rows of the result for other regions are dropped.
+
+        """
+        regions = list(regions)
+        if len(result) == 0:
+            return cls([], regions, np.full((0, len(regions)), np.nan, dtype=np.float32))
+        years = np.arange(result.time.min(), result.time.max() + 1)
+        # column of each region code of the result, -1 for the regions that are not in regions
+        position = { region: i for i, region in enumerate(regions) }
+        column_of = np.array([ position.get(rid, -1) for rid in np.asarray(result.ids).tolist() ], dtype=np.intp)
+        cols = column_of[result.region]
+        rows = cols >= 0
+        values = np.full((len(years), len(regions)), np.nan, dtype=np.float32)
+        values[result.time[rows] - years[0], cols[rows]] = result.columns[column][rows]
+        return cls(years, regions, values)
+
+    @cached_property
+    def statistics(self):
+        """ summary statistics of every year, computed once for all years, see row_statistics """
+        return row_statistics(self.values)
+
+    @cached_property
+    def global_statistics(self):
+        """ summary statistics of all the years together, as a single row, see row_statistics """
+        return row_statistics(self.values.reshape(1, -1))
+
+    def year_statistics(self, year, global_scale=False):
+        """ { name: value, ... } of the statistics of a year, or of all years if global_scale """
+        if global_scale:
+            return { name: values[0].item() for name, values in self.global_statistics.items() }
+        if self.year_values(year) is None:
+            return None
+        return { name: values[year - self.years[0]].item() for name, values in self.statistics.items() }
+
+    def year_values(self, year):
+        """ the values of every region in a year, None if the year is out of range """
+        if len(self.years) == 0 or not self.years[0] <= year <= self.years[-1]:
+            return None
+        return self.values[year - self.years[0]]
+
+    def series(self, region):
+        """ the values of a region for every year, None for an unknown region """
+        i = self.index.get(region)
+        return self.values[:, i] if i is not None else None
+
+    def value(self, year, region):
+        """ the value of a region in a year, NaN if there is none """
+        row, i = self.year_values(year), self.index.get(region)
+        return float(row[i]) if row is not None and i is not None else np.nan
@@ -0,0 +1,61 @@
+""" Coalescing of high-frequency widget events.
+
+Dragging a slider or playing an animation sends a stream of value changes.
+A Debouncer handles the first one right away, then at most one every `wait`
+seconds, always with the latest value: the values received while the handler
+is waiting are dropped, except for the last one.
+
+    slider.observe(Debouncer(handler, 0.25), names='value')
+
+The handler runs on the event loop of the kernel, like the widget events
+themselves, so that it can update props and widgets.
+"""
+import time
+from tornado.ioloop import IOLoop
+
+
+class Debouncer:
+    """ Call a function at most once every `wait` seconds, with the latest arguments """
+
+    def __init__(self, f, wait):
+        """ initializer, to be called from the kernel's thread, whose event loop calls f.
+
+        :f: the function to call
+        :wait: the minimum time between two calls, in seconds
+        :returns: None
+
+        """
+        self._f = f
+        self._wait = wait
+        self._loop = IOLoop.current()
+        # (args, kwargs) of the latest call that isn't handled yet
+        self._pending = None
+        # set while a call is scheduled
+        self._timeout = None
+        self._last = float('-inf')
+
+    def __call__(self, *args, **kwargs):
+        self._pending = (args, kwargs)
+        if self._timeout is not None:
+            return
+        delay = self._last + self._wait - time.monotonic()
+        if delay <= 0:
+            self._flush()
+        else:
+            self._timeout = self._loop.call_later(delay, self._flush)
+
+    def cancel(self):
+        """ drop the scheduled call, if any """
+        if self._timeout is not None:
+            self._loop.remove_timeout(self._timeout)
+            self._timeout = None
+        self._pending = None
+
+    def _flush(self):
+        self._timeout = None
+        args, kwargs = self._pending
+        self._pending = None
+        try:
+            self._f(*args, **kwargs)
+        finally:
+            self._last = time.monotonic()
@@ -0,0 +1,140 @@
+""" Streamed file downloads, served by the kernel.
+
+Rather than sending the content of a download to the browser through the
+widget comm, as a base64 data URI, the kernel serves it over HTTP in chunks:
+
+    server = get_server()
+    token = server.register("result.csv", cache.csv_chunks(path))
+    # the browser fetches server.url(token), relative to the Jupyter base URL
+
+The content is an iterable of bytes, e.g. file_chunks(path), only consumed
+while the browser reads it, so the memory used doesn't depend on its size.
+A token is random, can only be used once, and expires after ttl seconds.
+
+The server listens on 127.0.0.1 only. The browser reaches it through
+jupyter-server-proxy, which requires the Jupyter login, see URL_TEMPLATE.
+"""
+import secrets
+import threading
+import time
+from urllib.parse import quote
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.netutil import bind_sockets
+
+# the URL of a download, relative to the Jupyter base URL, or absolute
+URL_TEMPLATE = "proxy/{port}/download/{token}"
+TOKEN_TTL = 60
+CHUNK_SIZE = 2**20
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    """ the content of a file, as chunks of at most chunk_size bytes """
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+def _close(chunks):
+    # runs the finally blocks of a generator, e.g. to remove a temporary file
+    close = getattr(chunks, "close", None)
+    if close is not None:
+        close()
+
+
+class DownloadHandler(tornado.web.RequestHandler):
+    """ GET /download/<token>: the content registered under token """
+
+    def initialize(self, server):
+        self.server = server
+
+    async def get(self, token):
+        download = self.server.take(token)
+        if download is None:
+            raise tornado.web.HTTPError(404)
+        filename, chunks = download
+        self.set_header("Content-Type", "application/octet-stream")
+        self.set_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(filename)}")
+        self.set_header("Cache-Control", "no-store")
+        loop = IOLoop.current()
+        try:
+            while True:
+                # generating a chunk may read a file or format rows, off the kernel's event loop
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                self.write(chunk)
+                # waits for the chunk to be sent: at most one chunk is held in memory
+                await self.flush()
+        except StreamClosedError:
+            # the download was cancelled in the browser
+            pass
+        finally:
+            _close(chunks)
+
+
+class DownloadServer:
+    """ An HTTP server in the kernel, serving registered downloads once """
+
+    def __init__(self, port=0, url_template=URL_TEMPLATE, ttl=TOKEN_TTL):
+        """ initializer, to be called from the kernel's event loop thread, see get_server.
+
+        :port: the port to listen to on 127.0.0.1, 0 for any free port
+        :url_template: the URL of a download, with {port} and {token}
+        :ttl: the time a registered download can be started, in seconds
+        :returns: None
+
+        """
+        self.url_template = url_template
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # { token: (filename, chunks, expiry), ... }
+        self._downloads = {}
+        sockets = bind_sockets(port, address="127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        app = tornado.web.Application([(r"/download/([\w-]+)", DownloadHandler, dict(server=self))])
+        self._http = HTTPServer(app)
+        self._http.add_sockets(sockets)
+
+    def register(self, filename, chunks):
+        """ make a download available once
+
+        :filename: the name of the downloaded file
+        :chunks: the content, bytes or an iterable of bytes
+        :returns: the token of the download, see url
+
+        """
+        if isinstance(chunks, (bytes, bytearray)):
+            chunks = [chunks]
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._expire()
+            self._downloads[token] = (filename, iter(chunks), time.monotonic() + self.ttl)
+        return token
+
+    def take(self, token):
+        """ (filename, chunks) of a download, which can't be taken again, None if unknown or expired """
+        with self._lock:
+            self._expire()
+            download = self._downloads.pop(token, None)
+        return download[:2] if download is not None else None
+
+    def url(self, token):
+        """ the URL of a download, see url_template """
+        return self.url_template.format(port=self.port, token=token)
+
+    def _expire(self):
+        now = time.monotonic()
+        for token in [ token for token, (_, _, expiry) in self._downloads.items() if expiry < now ]:
+            _close(self._downloads.pop(token)[1])
+
+
+_server = None
+
+def get_server(port=0, url_template=URL_TEMPLATE, ttl=TOKEN_TTL):
+    """ the DownloadServer of the kernel, started by the first call with its arguments """
+    global _server
+    if _server is None:
+        _server = DownloadServer(port, url_template, ttl)
+    return _server
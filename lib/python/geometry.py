@@ -0,0 +1,175 @@
+""" Topology-preserving simplification of the country geometry of the map.
+
+The rings of all polygons are cut into arcs at the points where the set of
+polygons sharing a border changes, like TopoJSON does. Every arc is
+simplified once with Douglas-Peucker, keeping its ends, and the rings are
+rebuilt from the simplified arcs, so that neighboring countries keep sharing
+the exact same border. The levels are prepared ahead of time:
+
+    python -m lib.python.geometry data/countries.geo.json 0.25 0.08
+
+which writes data/countries.geo.0.25.json and data/countries.geo.0.08.json,
+see level_path and Const.GEODATA_LEVELS.
+"""
+import argparse
+import json
+import os
+import numpy as np
+
+
+def level_path(path, tolerance):
+    """ path of the geometry of path simplified with tolerance, path itself for 0 """
+    if not tolerance:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.{tolerance:g}{ext}"
+
+def polygons(geometry):
+    """ the polygons of a Polygon or MultiPolygon geometry, each a list of rings """
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+
+def douglas_peucker(points, tolerance):
+    """ simplify a polyline, keeping its first and last points
+
+    :points: array of shape (n, 2)
+    :returns: the indices of the points to keep, in order
+
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        inner = points[start + 1:end]
+        d = b - a
+        norm = np.hypot(*d)
+        if norm == 0:
+            distances = np.hypot(*(inner - a).T)
+        else:
+            distances = np.abs(d[0] * (inner[:, 1] - a[1]) - d[1] * (inner[:, 0] - a[0])) / norm
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            keep[start + 1 + i] = True
+            stack += [(start, start + 1 + i), (start + 1 + i, end)]
+    return np.flatnonzero(keep)
+
+def _edge(p, q):
+    return (p, q) if p <= q else (q, p)
+
+def _canonical(arc):
+    """ the same key for an arc and its reverse, and whether arc is reversed relative to the key """
+    reverse = arc[::-1]
+    return (tuple(reverse), True) if reverse < arc else (tuple(arc), False)
+
+def _rotate_closed(ring):
+    """ rotate a closed ring without junctions to a canonical start point and orientation """
+    points = ring[:-1]
+    start = points.index(min(points))
+    forward = points[start:] + points[:start]
+    backward = [forward[0]] + forward[1:][::-1]
+    return (forward if forward <= backward else backward) + [forward[0]]
+
+def simplify(geojson, tolerance, decimals=3):
+    """ simplify the polygons of a FeatureCollection, preserving shared borders
+
+    Rings without any shared border that collapse are dropped, unless they are
+    the last ring of their feature.
+
+    :geojson: a FeatureCollection of Polygons and MultiPolygons
+    :tolerance: the Douglas-Peucker tolerance, in degrees
+    :decimals: coordinates are rounded to that many decimals
+    :returns: a new FeatureCollection
+
+    """
+    rings = []
+    for f in geojson['features']:
+        for polygon in polygons(f['geometry']):
+            for ring in polygon:
+                rings.append([ (float(x), float(y)) for x, y in ring ])
+
+    # the rings sharing each edge
+    edge_rings = {}
+    for r, ring in enumerate(rings):
+        for p, q in zip(ring[:-1], ring[1:]):
+            edge_rings.setdefault(_edge(p, q), set()).add(r)
+
+    simplified = {}
+    def simplify_arc(arc):
+        key, reverse = _canonical(arc)
+        if key not in simplified:
+            points = np.array(key)
+            kept = douglas_peucker(points, tolerance)
+            simplified[key] = [ tuple(np.round(points[i], decimals).tolist()) for i in kept ]
+        result = simplified[key]
+        return result[::-1] if reverse else result
+
+    def simplify_ring(ring):
+        n = len(ring) - 1
+        sharing = [ frozenset(edge_rings[_edge(ring[i], ring[i + 1])]) for i in range(n) ]
+        # a junction is where the set of rings sharing the border changes
+        junctions = [ i for i in range(n) if sharing[i] != sharing[i - 1] ]
+        if not junctions:
+            closed = _rotate_closed(ring)
+            # split at the farthest point, so that a ring keeps at least 3 points
+            points = np.array(closed)
+            far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+            return simplify_arc(closed[:far + 1]) + simplify_arc(closed[far:])[1:], len(sharing[0]) == 1
+        start = junctions[0]
+        rotated = ring[start:-1] + ring[:start + 1]
+        cuts = [ j - start for j in junctions ] + [n]
+        result = []
+        for a, b in zip(cuts[:-1], cuts[1:]):
+            result += simplify_arc(rotated[a:b + 1])[1 if result else 0:]
+        return result, False
+
+    features, r = [], 0
+    for f in geojson['features']:
+        kept_polygons, original = [], []
+        for polygon in polygons(f['geometry']):
+            new_polygon = []
+            for i, ring in enumerate(polygon):
+                new_ring, unshared = simplify_ring(rings[r])
+                r += 1
+                collapsed = len(set(new_ring)) < 3
+                if collapsed and unshared:
+                    if i == 0:
+                        # without its exterior ring, the polygon is gone
+                        new_polygon = None
+                    continue
+                if new_polygon is not None:
+                    new_polygon.append([ list(p) for p in new_ring ])
+            original.append(polygon)
+            if new_polygon:
+                kept_polygons.append(new_polygon)
+        if not kept_polygons:
+            # keep every feature on the map, if only as its original outline
+            kept_polygons = original[:1]
+        geometry = ({ 'type': 'Polygon', 'coordinates': kept_polygons[0] } if len(kept_polygons) == 1
+                    else { 'type': 'MultiPolygon', 'coordinates': kept_polygons })
+        features.append({ **f, 'geometry': geometry })
+    return { **geojson, 'features': features }
+
+
+def main(argv=None):
+    """ prepare simplified levels of a GeoJSON file of countries """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("path", help="the GeoJSON file, e.g. data/countries.geo.json")
+    parser.add_argument("tolerances", nargs="+", type=float, help="Douglas-Peucker tolerances, in degrees")
+    args = parser.parse_args(argv)
+    with open(args.path, 'r') as f:
+        geojson = json.load(f)
+    for tolerance in args.tolerances:
+        dest = level_path(args.path, tolerance)
+        with open(dest, 'w') as f:
+            json.dump(simplify(geojson, tolerance), f, separators=(',', ':'))
+        print(f"{args.path} -> {dest}: {os.path.getsize(dest)} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+""" Region maps and weight maps on the 30 min grid.
+
+Region map csv files (lon, lat, id) are compiled once into an int32 grid of
+region codes plus a code-to-id table, and weight map csv files (lon, lat,
+weight) into a float32 grid of weights plus a validity mask. The grids are
+stored as .npy files in a '.compiled' directory next to the csv, and
+memory-mapped on load. The compiled files are
+rebuilt whenever the content of the csv changes, so the files can be shared
+by every kernel on the host.
+"""
+import csv
+import hashlib
+import json
+import os
+import numpy as np
+
+# dimensions of the GGCMI phase 3 grid, see read.AgMIP.RData
+NLON = 720
+NLAT = 360
+RESOLUTION = 0.5
+
+COMPILED_DIR = ".compiled"
+# bump when the compiled layout changes, to force recompilation
+COMPILED_VERSION = 1
+
+# values R's read.csv treats as missing
+NA_STRINGS = ("", "NA")
+
+
+def lon_index(lon):
+    """ column of the grid for the given longitude(s), -179.75 is the first column """
+    return np.rint((np.asarray(lon, dtype=np.float64) + 180 - RESOLUTION / 2) / RESOLUTION).astype(np.intp)
+
+def lat_index(lat):
+    """ row of the grid for the given latitude(s), 89.75 is the first row """
+    return np.rint((90 - RESOLUTION / 2 - np.asarray(lat, dtype=np.float64)) / RESOLUTION).astype(np.intp)
+
+
+def read_region_map(path):
+    """ read a region map csv with columns lon, lat and id
+
+    :path: path to the csv file
+    :returns: (codes, ids), where codes is an int32 grid of shape (lat, lon) holding
+        an index into ids for every cell, -1 for cells without a region,
+        and ids is the sorted array of region ids.
+
+    """
+    lons, lats, cell_ids = [], [], []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['id'] in NA_STRINGS:
+                continue
+            lons.append(float(row['lon']))
+            lats.append(float(row['lat']))
+            cell_ids.append(row['id'])
+    ids, inverse = np.unique(np.array(cell_ids, dtype=str), return_inverse=True)
+    codes = np.full((NLAT, NLON), -1, dtype=np.int32)
+    codes[lat_index(lats), lon_index(lons)] = inverse
+    return codes, ids
+
+def read_weight_map(path):
+    """ read a weight map csv with columns lon, lat and weight
+
+    :path: path to the csv file
+    :returns: (weights, mask), where weights is a float32 grid of shape (lat, lon),
+        and mask is True for the cells that have a weight. Weights outside the mask are 0.
+
+    """
+    weights = np.zeros((NLAT, NLON), dtype=np.float32)
+    mask = np.zeros((NLAT, NLON), dtype=bool)
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['weight'] in NA_STRINGS:
+                continue
+            i, j = lat_index(row['lat']), lon_index(row['lon'])
+            weights[i, j] = float(row['weight'])
+            mask[i, j] = True
+    return weights, mask
+
+
+def content_hash(path):
+    """ sha1 hex digest of the content of a file """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def compiled_path(path, suffix):
+    """ path of a compiled artifact of the csv file at path """
+    dirname, fname = os.path.split(path)
+    return os.path.join(dirname, COMPILED_DIR, f"{os.path.splitext(fname)[0]}.{suffix}")
+
+def _write_atomic(dest, write):
+    """ write to a temporary file and move it to dest, so that readers never see a partial file """
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, dest)
+
+def _read_meta(path):
+    try:
+        with open(compiled_path(path, "json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(path, meta):
+    _write_atomic(compiled_path(path, "json"), lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+def get_meta(path, kind, compile_fn):
+    """ make sure the compiled artifacts of the csv file are up to date
+
+    :path: path to the csv file
+    :kind: the kind of map, stored in the metadata
+    :compile_fn: function (path) -> { suffix: array, ... }, the arrays to store
+    :returns: the metadata of the compiled artifacts, including the 'sha1' of the csv file
+
+    """
+    stat = os.stat(path)
+    meta = _read_meta(path)
+    if (meta is not None and meta['kind'] == kind and meta['version'] == COMPILED_VERSION and
+            all(os.path.exists(compiled_path(path, suffix)) for suffix in meta['arrays'])):
+        if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+            return meta
+        # touched but possibly unchanged, e.g. re-uploaded
+        sha1 = content_hash(path)
+        if meta['sha1'] == sha1:
+            meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            _write_meta(path, meta)
+            return meta
+    else:
+        sha1 = content_hash(path)
+
+    os.makedirs(os.path.dirname(compiled_path(path, "json")), exist_ok=True)
+    arrays = compile_fn(path)
+    for suffix, array in arrays.items():
+        _write_atomic(compiled_path(path, suffix), lambda f: np.save(f, array))
+    meta = dict(kind=kind, version=COMPILED_VERSION, sha1=sha1,
+                mtime_ns=stat.st_mtime_ns, size=stat.st_size, arrays=list(arrays))
+    _write_meta(path, meta)
+    return meta
+
+
+# { (kind, path): (mtime_ns, size, sha1, value), ... }
+_loaded = {}
+
+def _load(path, kind, compile_fn):
+    """ load the compiled arrays of a csv file, compiling it first if needed
+
+    :returns: (sha1, { suffix: memory-mapped array, ... })
+
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (kind, path)
+    cached = _loaded.get(key)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2:]
+    try:
+        meta = get_meta(path, kind, compile_fn)
+        value = { suffix: np.load(compiled_path(path, suffix), mmap_mode='r') for suffix in meta['arrays'] }
+        sha1 = meta['sha1']
+    except OSError:
+        # e.g. the directory isn't writable, compile in memory instead
+        value, sha1 = compile_fn(path), content_hash(path)
+    _loaded[key] = (stat.st_mtime_ns, stat.st_size, sha1, value)
+    return sha1, value
+
+
+def _compile_region_map(path):
+    codes, ids = read_region_map(path)
+    return { "codes.npy": codes, "ids.npy": ids }
+
+def load_region_map(path):
+    """ load a region map csv through its compiled grid
+
+    :path: path to the csv file
+    :returns: (codes, ids), see read_region_map, codes is memory-mapped
+
+    """
+    _, arrays = _load(path, "regionmap", _compile_region_map)
+    return arrays["codes.npy"], arrays["ids.npy"]
+
+def region_map_hash(path):
+    """ content hash of a region map csv, without re-reading the file when it is compiled """
+    return _load(path, "regionmap", _compile_region_map)[0]
+
+
+def _compile_weight_map(path):
+    weights, mask = read_weight_map(path)
+    return { "weights.npy": weights, "mask.npy": mask }
+
+def load_weight_map(path):
+    """ load a weight map csv through its compiled grid
+
+    :path: path to the csv file
+    :returns: (weights, mask), see read_weight_map, both are memory-mapped
+
+    """
+    _, arrays = _load(path, "weightmap", _compile_weight_map)
+    return arrays["weights.npy"], arrays["mask.npy"]
+
+def weight_map_hash(path):
+    """ content hash of a weight map csv, without re-reading the file when it is compiled """
+    return _load(path, "weightmap", _compile_weight_map)[0]
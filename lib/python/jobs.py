@@ -0,0 +1,99 @@
+""" Background jobs that report progress by stage and can be cancelled.
+
+A job runs a function in a daemon thread, so that the widgets stay responsive.
+The function receives a progress callback, progress(stage, fraction), which it
+should call regularly: cancelling the job makes the next call raise Cancelled.
+Cancellation is cooperative, a long call that doesn't report progress, e.g.
+reading a whole RData file, can't be interrupted.
+
+Only the function runs in the thread. The callbacks of the job run on the
+event loop of the thread that started it, the kernel's, like any widget event,
+so that they can update props and widgets.
+"""
+import threading
+import traceback
+from tornado.ioloop import IOLoop
+
+
+class Cancelled(Exception):
+    """ Raised in a job's thread when the job has been cancelled """
+
+def no_progress(stage, fraction=0.0):
+    """ progress callback that ignores the progress """
+
+
+class Job:
+    """ Run a function in the background.
+    job = Job(f, on_progress=..., on_done=..., on_error=..., on_cancel=...).start()
+    f is called as f(progress) and its return value is passed to on_done.
+    """
+
+    def __init__(self, f, on_progress=None, on_done=None, on_error=None, on_cancel=None):
+        """ initializer.
+
+        :f: the function to run, taking a progress callback
+        :on_progress: called with (stage, fraction) of the latest progress report,
+            reports made while the event loop is busy are dropped
+        :on_done: called with the return value of f
+        :on_error: called with the formatted traceback when f raises
+        :on_cancel: called without arguments once f has stopped after a cancellation
+        :returns: None
+
+        """
+        self._f = f
+        self._on_progress = on_progress
+        self._on_done = on_done
+        self._on_error = on_error
+        self._on_cancel = on_cancel
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._loop = None
+        self._lock = threading.Lock()
+        # the latest progress report not handled yet, None if there is none
+        self._pending_progress = None
+
+    def _progress(self, stage, fraction=0.0):
+        if self._cancelled.is_set():
+            raise Cancelled()
+        if self._on_progress is None:
+            return
+        with self._lock:
+            scheduled = self._pending_progress is not None
+            self._pending_progress = (stage, fraction)
+        if not scheduled:
+            self._loop.add_callback(self._report_progress)
+
+    def _report_progress(self):
+        with self._lock:
+            stage, fraction = self._pending_progress
+            self._pending_progress = None
+        self._on_progress(stage, fraction)
+
+    def _call(self, callback, *args):
+        # on the event loop, after the progress reports made before
+        if callback is not None:
+            self._loop.add_callback(callback, *args)
+
+    def _run(self):
+        try:
+            result = self._f(self._progress)
+        except Cancelled:
+            self._call(self._on_cancel)
+        except Exception:
+            self._call(self._on_error, traceback.format_exc())
+        else:
+            self._call(self._on_done, result)
+
+    def start(self):
+        """ start the job, from the thread whose event loop runs the callbacks """
+        self._loop = IOLoop.current()
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """ stop the job at its next progress report """
+        self._cancelled.set()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
@@ -0,0 +1,294 @@
+""" Persistent SQLite index of the metadata of the data files.
+
+Answers "which combinations exist, how large are they, which years and
+variables do they hold, and which are already aggregated, for which region
+maps" without listing directories or opening files. One row per file:
+
+    raw          RAW_DATA_DIR, the RData files: model, gcm, scenario
+    store        CHUNKED_DATA_DIR, their netCDF4 stores: years, variables
+    aggregation  AGGREGATED_CACHE_DIR, the cached results: years, variables,
+                 inputs, region and weight maps, crop and option
+    combined     COMBINED_CACHE_DIR, any file: size and hash only
+
+and for every file its size, modification time and SHA-1 content hash. The
+index is maintained incrementally, only the files whose size or modification
+time changed are read again:
+
+    python -m lib.python.metadata update
+    python -m lib.python.metadata query raw --scenario ssp126
+    python -m lib.python.metadata query aggregation --region-map WorldId.csv
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from . import paths
+from .cache import RESULT_EXT, RESULT_META, read_meta
+from .catalog import parse_file_name
+from .rawdata import STORE_EXT
+
+KINDS = ("raw", "store", "aggregation", "combined")
+# the columns of the index, besides path and kind
+COLUMNS = ("name", "size", "mtime_ns", "sha1", "model", "gcm", "scenario", "crop", "option",
+           "region_map", "weight_map", "inputs", "year_start", "year_end", "variables", "rows",
+           "indexed_at")
+# stored as JSON text
+JSON_COLUMNS = ("inputs", "variables")
+SCHEMA_VERSION = 1
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT,
+    model TEXT, gcm TEXT, scenario TEXT, crop TEXT, option TEXT,
+    region_map TEXT, weight_map TEXT, inputs TEXT,
+    year_start INTEGER, year_end INTEGER, variables TEXT, rows INTEGER,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_combination ON files (kind, model, gcm, scenario);
+CREATE INDEX IF NOT EXISTS files_aggregation ON files (kind, region_map, crop, option);
+PRAGMA user_version = {SCHEMA_VERSION};
+"""
+
+
+def file_hash(path, chunk_size=2**20):
+    """ SHA-1 of the content of a file, or of the files of a directory in name order """
+    sha1 = hashlib.sha1()
+    paths = [ os.path.join(path, name) for name in sorted(os.listdir(path)) ] if os.path.isdir(path) else [path]
+    for p in paths:
+        with open(p, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha1.update(chunk)
+    return sha1.hexdigest()
+
+def _stat(path):
+    """ (size, mtime_ns) of a file, or of a result directory: its total size and the time of meta.json """
+    if os.path.isdir(path):
+        size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        return size, os.stat(os.path.join(path, RESULT_META)).st_mtime_ns
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def _raw_metadata(path):
+    model, gcm, scenario = parse_file_name(os.path.basename(path))
+    return { "model": model, "gcm": gcm, "scenario": scenario }
+
+def _store_metadata(path):
+    import netCDF4
+    with netCDF4.Dataset(path, "r") as ds:
+        years = ds["time"][:]
+        fields = parse_file_name(ds.source) or (None, None, None)
+        return {
+            "model": fields[0], "gcm": fields[1], "scenario": fields[2],
+            "inputs": [ds.source],
+            "year_start": int(years[0]) if len(years) else None,
+            "year_end": int(years[-1]) if len(years) else None,
+            "variables": [ name for name in ds.variables if name not in ds.dimensions ],
+        }
+
+def _aggregation_metadata(path):
+    import numpy as np
+    meta = read_meta(path)
+    info = meta.get("info") or {}
+    years = np.load(os.path.join(path, "time.npy"), mmap_mode='r')
+    inputs = info.get("inputs") or []
+    # the combination of a single input, the scenario of an ensemble
+    fields = [ parse_file_name(name) or (None, None, None) for name in inputs ]
+    same = lambda values: values[0] if values and all(v == values[0] for v in values) else None
+    return {
+        "model": same([ f[0] for f in fields ]),
+        "gcm": same([ f[1] for f in fields ]),
+        "scenario": same([ f[2] for f in fields ]),
+        "crop": info.get("crop"),
+        "option": info.get("option"),
+        "region_map": info.get("region_map"),
+        "weight_map": info.get("weight_map"),
+        "inputs": inputs,
+        "year_start": int(years.min()) if len(years) else None,
+        "year_end": int(years.max()) if len(years) else None,
+        "variables": meta["columns"],
+        "rows": meta["rows"],
+    }
+
+# { kind: (the file names to index, the metadata of a file) }
+_KIND_HANDLERS = {
+    "raw": (lambda name: parse_file_name(name) is not None, _raw_metadata),
+    "store": (lambda name: name.endswith(STORE_EXT), _store_metadata),
+    "aggregation": (lambda name: name.endswith(RESULT_EXT), _aggregation_metadata),
+    "combined": (lambda name: not name.endswith(".tmp"), lambda path: {}),
+}
+
+
+class MetadataIndex:
+    """ The SQLite index of the data files, see the module documentation """
+
+    def __init__(self, db_path, hash_contents=True):
+        """ initializer.
+
+        :db_path: the SQLite database, created if needed
+        :hash_contents: compute the SHA-1 of new and changed files, which reads them entirely
+        :returns: None
+
+        """
+        self.db_path = db_path
+        self.hash_contents = hash_contents
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as db:
+            # concurrent readers, e.g. other kernels, while a writer updates the index
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        # a connection per call: the index is also updated from a background thread, see Model.start
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def update(self, kind, dirpath, hash_contents=None):
+        """ index the new and changed files of a directory, and forget the removed ones
+
+        :kind: one of KINDS
+        :dirpath: the directory of those files
+        :hash_contents: whether to compute the SHA-1 of the files, defaults to the one of the index.
+            With hashes, the files indexed without one are indexed again.
+        :returns: (indexed, removed), the numbers of files indexed again and forgotten
+
+        """
+        hash_contents = self.hash_contents if hash_contents is None else hash_contents
+        accept, _ = _KIND_HANDLERS[kind]
+        present = {}
+        if os.path.isdir(dirpath):
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    if not accept(entry.name):
+                        continue
+                    if kind == "aggregation" and not os.path.exists(os.path.join(entry.path, RESULT_META)):
+                        # still being written
+                        continue
+                    if kind != "aggregation" and not entry.is_file():
+                        continue
+                    present[os.path.abspath(entry.path)] = entry.path
+        with closing(self._connect()) as db, db:
+            rows = db.execute("SELECT path, size, mtime_ns, sha1 FROM files WHERE kind = ?", (kind,)).fetchall()
+            removed = [ row["path"] for row in rows if row["path"] not in present ]
+            # the files indexed again, unless unchanged
+            known = { row["path"]: (row["size"], row["mtime_ns"])
+                      for row in rows if row["sha1"] is not None or not hash_contents }
+            db.executemany("DELETE FROM files WHERE path = ?", [ (path,) for path in removed ])
+        indexed = 0
+        for path in present:
+            try:
+                if known.get(path) != _stat(path):
+                    self.index_file(kind, path, hash_contents)
+                    indexed += 1
+            except FileNotFoundError:
+                # removed while indexing
+                continue
+        return indexed, len(removed)
+
+    def index_file(self, kind, path, hash_contents=None):
+        """ index a single file, e.g. an aggregation result that was just saved
+
+        :hash_contents: whether to compute the SHA-1 of the file, defaults to the one of the index
+        """
+        hash_contents = self.hash_contents if hash_contents is None else hash_contents
+        _, metadata = _KIND_HANDLERS[kind]
+        path = os.path.abspath(path)
+        size, mtime_ns = _stat(path)
+        row = {
+            "name": os.path.basename(path),
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "sha1": file_hash(path) if hash_contents else None,
+            "indexed_at": time.time(),
+            **metadata(path),
+        }
+        values = [ json.dumps(row.get(c)) if c in JSON_COLUMNS and row.get(c) is not None else row.get(c)
+                   for c in COLUMNS ]
+        with closing(self._connect()) as db, db:
+            db.execute(f"INSERT OR REPLACE INTO files (path, kind, {', '.join(COLUMNS)}) "
+                       f"VALUES (?, ?, {', '.join('?' * len(COLUMNS))})", [path, kind, *values])
+
+    def query(self, kind=None, **filters):
+        """ the indexed files matching the filters
+
+        e.g. query('aggregation', region_map='WorldId.csv', scenario='ssp126')
+
+        :kind: one of KINDS, None for all
+        :filters: { column: value, ... }, see COLUMNS. None values aren't filtered on.
+        :returns: a list of dicts, one per file, ordered by name
+
+        """
+        filters = { k: v for k, v in filters.items() if v is not None }
+        unknown = set(filters) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns: {sorted(unknown)}. Columns must be in {COLUMNS}")
+        if kind is not None:
+            filters["kind"] = kind
+        where = " AND ".join(f"{column} = ?" for column in filters) or "1"
+        with closing(self._connect()) as db:
+            rows = db.execute(f"SELECT * FROM files WHERE {where} ORDER BY name", list(filters.values())).fetchall()
+        return [ self._row(row) for row in rows ]
+
+    def combinations(self, kind="raw"):
+        """ the set of (model, gcm, scenario) with a file of kind """
+        with closing(self._connect()) as db:
+            return set(map(tuple, db.execute("SELECT model, gcm, scenario FROM files WHERE kind = ?", (kind,))))
+
+    @staticmethod
+    def _row(row):
+        row = dict(row)
+        for column in JSON_COLUMNS:
+            if row[column] is not None:
+                row[column] = json.loads(row[column])
+        return row
+
+
+def default_dirs():
+    """ { kind: directory, ... } of the app """
+    return {
+        "raw": paths.RAW_DATA_DIR,
+        "store": paths.CHUNKED_DATA_DIR,
+        "aggregation": paths.AGGREGATED_CACHE_DIR,
+        "combined": paths.COMBINED_CACHE_DIR,
+    }
+
+def main(argv=None):
+    """ update or query the metadata index """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--db", default=paths.METADATA_INDEX, help="the SQLite database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    update = commands.add_parser("update", help="index the new and changed files")
+    update.add_argument("kinds", nargs="*", choices=KINDS, help="default all")
+    update.add_argument("--no-hash", action="store_true", help="don't compute content hashes")
+    query = commands.add_parser("query", help="print the indexed files as JSON lines")
+    query.add_argument("kind", nargs="?", choices=KINDS)
+    for column in ("model", "gcm", "scenario", "crop", "option", "region_map", "weight_map", "name"):
+        query.add_argument(f"--{column.replace('_', '-')}", dest=column)
+    args = parser.parse_args(argv)
+
+    if args.command == "update":
+        index = MetadataIndex(args.db, hash_contents=not args.no_hash)
+        for kind, dirpath in default_dirs().items():
+            if args.kinds and kind not in args.kinds:
+                continue
+            start = time.time()
+            indexed, removed = index.update(kind, dirpath)
+            print(f"{kind}: {indexed} indexed, {removed} removed in {time.time() - start:.1f}s ({dirpath})")
+    else:
+        index = MetadataIndex(args.db)
+        filters = { column: getattr(args, column) for column in
+                    ("model", "gcm", "scenario", "crop", "option", "region_map", "weight_map", "name") }
+        for row in index.query(args.kind, **filters):
+            print(json.dumps(row))
+
+if __name__ == "__main__":
+    main()
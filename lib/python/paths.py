@@ -0,0 +1,13 @@
+""" Default locations of the data files and caches.
+
+Shared by the app, see Const in app/cfg.py, and the command line tools of
+lib/python, which don't import the app and its widgets.
+"""
+
+RAW_DATA_DIR = '/data/tools/agmip/rdata/'
+COMBINED_CACHE_DIR = 'cache/combined/'
+# chunked stores of the RData files, see lib/python/rawdata.py
+CHUNKED_DATA_DIR = 'cache/chunked/'
+AGGREGATED_CACHE_DIR = 'cache/aggregated/'
+# SQLite index of the metadata of the files of the directories above, see lib/python/metadata.py
+METADATA_INDEX = 'cache/metadata.sqlite'
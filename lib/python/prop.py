@@ -1,3 +1,11 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from traitlets import HasTraits, Any, Bool, observe
 import ipywidgets as widgets
 from tabulate import tabulate
@@ -37,12 +45,208 @@ def extract_operand(rhs):
         raise ValueError(f"Invalid operand: {rhs}. Operand must be either a prop/callable, or a (prop/callable, dict)")
 
 
+# every live prop, for export_graph
+_registry = weakref.WeakSet()
+
+class _BatchState(threading.local):
+    """ the changes deferred by batch(), per thread: a batch only defers the changes of its own thread """
+
+    def __init__(self):
+        self.depth = 0
+        # heap of (rank, sequence number, ComputedProp), the props to recompute
+        self.dirty = []
+        self.queued = set()
+        # { (widget, prop): value, ... }, the latest values for the outputs of SyncedProps
+        self.outputs = {}
+        self.sequence = itertools.count()
+
+_batch_state = _BatchState()
+
+def batching():
+    return _batch_state.depth > 0
+
+@contextmanager
+def batch():
+    """ defer the propagation of prop changes until the end of the with statement
+
+    Inside the with statement, SyncedProps don't write to their outputs and ComputedProps
+    don't recompute. On exit, each output is written once with its latest value, and each
+    ComputedProp whose inputs changed is recomputed once, in topological order, so that
+    no intermediate state is observed. Batches can be nested, the outermost one propagates.
+
+        with batch():
+            slider.min = 2000
+            slider.max = 2100
+    """
+    _batch_state.depth += 1
+    try:
+        yield
+    finally:
+        _batch_state.depth -= 1
+        if _batch_state.depth == 0:
+            _flush()
+
+def _defer_output(widget, prop, value):
+    _batch_state.outputs.pop((widget, prop), None)
+    _batch_state.outputs[(widget, prop)] = value
+
+def _defer_update(computed):
+    if computed not in _batch_state.queued:
+        _batch_state.queued.add(computed)
+        heapq.heappush(_batch_state.dirty, (rank(computed), next(_batch_state.sequence), computed))
+
+def _flush():
+    # changes made while propagating are deferred and ordered too
+    _batch_state.depth = 1
+    try:
+        while _batch_state.outputs or _batch_state.dirty:
+            while _batch_state.outputs:
+                (widget, prop), value = next(iter(_batch_state.outputs.items()))
+                del _batch_state.outputs[(widget, prop)]
+                setattr(widget, prop, value)
+            if _batch_state.dirty:
+                _, _, computed = heapq.heappop(_batch_state.dirty)
+                if computed not in _batch_state.queued or computed not in _registry:
+                    # disposed while queued
+                    continue
+                _batch_state.queued.discard(computed)
+                computed.update_value()
+    finally:
+        _batch_state.depth = 0
+        _batch_state.dirty.clear()
+        _batch_state.queued.clear()
+        _batch_state.outputs.clear()
+
+def rank(obj, visiting=None):
+    """ the depth of obj in the prop graph: 0 for a widget, 1 + the highest rank of the inputs for a prop """
+    sources = getattr(obj, '_sources', None)
+    if not sources:
+        return 0
+    visiting = set() if visiting is None else visiting
+    if obj in visiting:
+        # a cycle, e.g. two props synced with each other
+        return 0
+    visiting.add(obj)
+    try:
+        return 1 + max(rank(source, visiting) for source, _ in sources)
+    finally:
+        visiting.discard(obj)
+
+
+class PropScope:
+    """ Owner of the props created while it is entered, until it is disposed
+
+        self._props = PropScope()
+        with self._props:
+            SyncedProp() << (~a | b) >> widget  # the intermediate props belong to the scope too
+        ...
+        self._props.dispose()
+
+    Props created outside of any scope belong to the app, and live as long as the kernel.
+    The observers registered by props only hold them weakly: the props of a scope that is
+    garbage collected without being disposed are collected too, and their observers removed.
+    """
+
+    def __init__(self):
+        self._props = {} # { prop: None, ... }, in creation order
+
+    def __enter__(self):
+        _scopes.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _scopes.remove(self)
+
+    def __len__(self):
+        return len(self._props)
+
+    def add(self, prop):
+        self._props[prop] = None
+        prop._scope = self
+
+    def dispose(self):
+        """ dispose of the props of the scope, the most recent first """
+        while self._props:
+            next(reversed(self._props)).dispose()
+
+# the scopes being entered, the props created now belong to the last one
+_scopes = [PropScope()]
+
+@contextmanager
+def temporary_props():
+    """ dispose of the props created in the with statement at its end """
+    scope = PropScope()
+    try:
+        with scope:
+            yield scope
+    finally:
+        scope.dispose()
+
+def _register(prop):
+    _registry.add(prop)
+    _scopes[-1].add(prop)
+    prop._observations = [] # [(weak reference to widget, handler, prop), ...] registered by prop, see _observe
+    # remove the observers of a prop that is garbage collected without being disposed
+    weakref.finalize(prop, _unobserve, prop._observations)
+
+def _observe(prop, widget, handler, name):
+    widget.observe(handler, name)
+    # weakly, the finalizer of prop mustn't keep its inputs alive
+    prop._observations.append((weakref.ref(widget), handler, name))
+
+def _unobserve(observations):
+    for ref, handler, name in observations:
+        widget = ref()
+        if widget is None:
+            continue
+        try:
+            widget.unobserve(handler, name)
+        except ValueError:
+            # already removed, e.g. by the widget
+            pass
+    observations.clear()
+
+def _dispose(prop):
+    """ stop prop from observing or notifying anything, and release it from its scope """
+    _unobserve(prop._observations)
+    prop.unobserve_all()
+    _registry.discard(prop)
+    # queued by a batch of another thread, it's skipped by that batch, see _flush
+    _batch_state.queued.discard(prop)
+    if prop._scope is not None:
+        del prop._scope._props[prop]
+        prop._scope = None
+
+class _WeakHandler:
+    """ An observer calling a method of a prop, without keeping the prop alive """
+
+    def __init__(self, method, *args):
+        self._method = weakref.WeakMethod(method)
+        self._args = args
+
+    def __call__(self, change):
+        method = self._method()
+        if method is not None:
+            # otherwise the prop is being garbage collected, and its finalizer removes this observer
+            method(change, *self._args)
+
+
 class Prop(HasTraits):
     """ Simple Prop with a 'value' attribute. """
     value = Any()
     def __init__(self, value=None):
+        _register(self)
         self.value = value
 
+    def dispose(self):
+        """ stop notifying the props and widgets observing this one """
+        _dispose(self)
+
+    @observe('value')
+    def _record_change(self, change):
+        if _stats is not None:
+            _record(self, 0.0, "set")
+
 class SyncedProp(HasTraits):
     """ Single synced prop to multiple widgets
     s1 = SyncedProp(widget, ..., value=None) # prop default to 'value'
@@ -56,6 +260,9 @@ class SyncedProp(HasTraits):
         """ args is a list of 2-tuples (widget, prop) or widget """
         self._output_props = set() # a set of (widget, prop), only update their values
         self._input_props = set() # a set of (widget, prop), only listen to their updates
+        self._sources = [] # the (widget, prop) inputs, see rank
+        self._trigger = None # the (widget, prop) input being handled, None for programmatic changes
+        _register(self)
         self.value = value
 
         for i in args:
@@ -64,22 +271,45 @@ class SyncedProp(HasTraits):
             else:
                 self.sync_prop(i)
 
+    def dispose(self):
+        """ stop listening to the inputs and writing to the outputs """
+        _dispose(self)
+        self._output_props = set()
+        self._input_props = set()
+        self._sources = []
+
     @observe('value')
     def _notify_listeners(self, change):
         """ handle programmatic change on 'value' """
         value = change['new']
         D(f"[_notify_listeners] {self}: setter called with {value}")
+        start = time.perf_counter() if _stats is not None else None
         for (widget, prop) in self._output_props:
-            setattr(widget, prop, value)
+            if batching():
+                _defer_output(widget, prop, value)
+            else:
+                setattr(widget, prop, value)
+        if start is not None:
+            _record(self, time.perf_counter() - start, self._trigger or "set")
 
-    def _update_self(self, new_value, trans=None):
-        """ handle updates from synced props """
+    def _on_input(self, change, trans):
+        self._update_self(change['new'], trans, (change['owner'], change['name']))
+
+    def _update_self(self, new_value, trans=None, source=None):
+        """ handle updates from synced props
+
+        :source: the (widget, prop) the value comes from, see instrument
+        """
         # print("change received:")
         # print(change)
         if trans is not None:
             new_value = trans(new_value)
         D(f"[_update_self] {self}: setting self to {new_value}")
-        self.value = new_value
+        self._trigger = source
+        try:
+            self.value = new_value
+        finally:
+            self._trigger = None
 
     def add_input_prop(self, widget, prop='value', sync=True, trans=None):
         """ Listen to a widget's property without modifying it when our own value changes.
@@ -90,10 +320,11 @@ class SyncedProp(HasTraits):
             Default to True.
         :trans: a transformer function for the updated value
         """
-        widget.observe(lambda change: self._update_self(change['new'], trans), prop)
+        _observe(self, widget, _WeakHandler(self._on_input, trans), prop)
         self._input_props.add((widget, prop))
+        self._sources.append((widget, prop))
         if sync:
-            self._update_self(getattr(widget, prop), trans)
+            self._update_self(getattr(widget, prop), trans, (widget, prop))
         return self
 
     # def resync(self):
@@ -163,6 +394,35 @@ class SyncedProp(HasTraits):
 
 # Thought: is it possible to combine SyncedProp and ComputedProp? <2022-03-29, David Deng> #
 
+_UNEVALUATED = object()
+
+def _equal(a, b):
+    """ a == b for values of the same type, items included, so that e.g. 0, 0.0 and False differ.
+    False when the values can't be compared, e.g. arrays """
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, (tuple, list)):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_equal(v, b[k]) for k, v in a.items())
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
+
+def _typed_key(key):
+    """ a key of the cache of outputs telling equal values of different types apart, like _equal """
+    if isinstance(key, tuple):
+        return (tuple, tuple(_typed_key(x) for x in key))
+    return (type(key), key)
+
+def _hashable(obj):
+    try:
+        hash(obj)
+    except TypeError:
+        return False
+    return True
+
 class ComputedProp(HasTraits):
     """ a read-only prop, whose 'value' is computed based on a function and a set of input widgets.
     c1 = ComputedProp(widget, ..., f=output_function) # prop default to 'value'
@@ -170,6 +430,12 @@ class ComputedProp(HasTraits):
     c3 = ComputedProp((widget, prop, name), ..., f=output_function)
     f should not have side effects.
     if any of the named input has a value of None, the output will also be None.
+    f is not evaluated again while the named inputs are equal to those of the last evaluation,
+    unless some inputs are unnamed, or resync is called, e.g. when f depends on the file system.
+    with cache_size, the outputs of the cache_size most recent hashable inputs are reused.
+    a lazy prop only evaluates f while it is active, e.g. while its display is visible, see
+    activate_when. Inactive, it only remembers that its inputs changed, and keeps its previous
+    value until it is activated or pulled, so it should only feed displays.
     """
     value = Any(read_only=True)
 
@@ -182,19 +448,32 @@ class ComputedProp(HasTraits):
     def get_named_inputs(self):
         return { name: self._cache_values[tup] for name, tup in self._inputs.items() if tup in self._cache_values }
 
-    def __init__(self, use_none=False):
+    def __init__(self, use_none=False, cache_size=0, lazy=False):
         """ initializer.
 
         :inputs: input triples.
         :f: the output function
+        :use_none: pass None inputs to f, instead of outputting None
+        :cache_size: the number of outputs to keep for previous inputs, 0 to only skip unchanged inputs
+        :lazy: only evaluate f while active, starting inactive, see set_active
         :returns: None
 
         """
 
         self._inputs = {} # { name: (widget, prop), ... }
         self._cache_values = {} # { (widget, prop): value, ... }
+        self._sources = [] # all the (widget, prop) inputs, named or not, see rank
+        self._has_unnamed_inputs = False # f may depend on inputs that aren't passed to it
+        self._trigger = None # the (widget, prop) input that caused the next update, see instrument
+        _register(self)
 
         self.use_none = use_none
+        self.cache_size = cache_size
+        self._evaluated = _UNEVALUATED # the named input values of the last evaluation of f
+        self._outputs = OrderedDict() # { _typed_key(input values): output, ... }, least recently used first
+        self.lazy = lazy
+        self._active = not lazy
+        self._stale = False # the inputs changed while inactive
 
         f = lambda **kwargs: str(kwargs) if kwargs else None
         self.set_output(f, sync=False) # don't evaluate right now
@@ -205,19 +484,93 @@ class ComputedProp(HasTraits):
         for name, (widget, prop) in self._inputs.items():
             self._cache_values[(widget, prop)] = getattr(widget, prop)
 
-    def update_value(self):
-        """ update the value based on the cache """
+    def update_value(self, force=False):
+        """ update the value based on the cache
+
+        :force: evaluate f even if the inputs are unchanged or cached
+
+        """
+        trigger, self._trigger = self._trigger or "wiring", None
+        if not self._active and not force:
+            self._stale = True
+            if _stats is not None:
+                _record(self, None, trigger)
+            return
+        self._stale = False
         if not self.use_none and None in self._cache_values.values():
             D(f"None value detected in inputs of computed prop: {self.get_named_inputs()}")
-            newvalue = None
+            self._evaluated = _UNEVALUATED
+            if _stats is not None:
+                _record(self, None, trigger)
+            self.set_trait('value', None)
+            return
+
+        kwargs = { k:self._cache_values[tup] for k, tup in self._inputs.items() }
+        key = tuple(kwargs.values())
+        memoize = not self._has_unnamed_inputs
+        if memoize and not force and _equal(key, self._evaluated):
+            D(f"inputs of computed prop unchanged: {self.get_named_inputs()}")
+            if _stats is not None:
+                _record(self, None, trigger)
+            return
+        cacheable = memoize and self.cache_size > 0 and _hashable(key)
+        if cacheable:
+            cache_key = _typed_key(key)
+
+        if cacheable and not force and cache_key in self._outputs:
+            self._outputs.move_to_end(cache_key)
+            newvalue = self._outputs[cache_key]
+            if _stats is not None:
+                _record(self, None, trigger)
         else:
-            newvalue = self._f(**{ k:self._cache_values[tup] for k, tup in self._inputs.items() })
+            start = time.perf_counter()
+            newvalue = self._f(**kwargs)
+            if _stats is not None:
+                _record(self, time.perf_counter() - start, trigger)
+            if cacheable:
+                self._outputs[cache_key] = newvalue
+                self._outputs.move_to_end(cache_key)
+                while len(self._outputs) > self.cache_size:
+                    self._outputs.popitem(last=False)
+        self._evaluated = key
         self.set_trait('value', newvalue)
 
+    def set_active(self, active):
+        """ start or stop evaluating f on input changes, catching up with the inputs when activated """
+        self._active = bool(active)
+        if self._active and self._stale:
+            self._trigger = "activation"
+            self.update_value()
+
+    def pull(self):
+        """ the value, evaluated first if the inputs changed while inactive """
+        if self._stale:
+            active, self._active = self._active, True
+            self._trigger = "pull"
+            try:
+                self.update_value()
+            finally:
+                self._active = active
+        return self.value
+
+    def dispose(self):
+        """ stop listening to the inputs, and forget them and the cached outputs """
+        _dispose(self)
+        self._inputs = {}
+        self._cache_values = {}
+        self._sources = []
+        self.invalidate()
+
+    def invalidate(self):
+        """ forget the previous outputs, e.g. when f depends on something else than its inputs """
+        self._evaluated = _UNEVALUATED
+        self._outputs.clear()
+
     def resync(self):
-        """ resync the value attribute """
+        """ resync the value attribute, evaluating f again """
         self.update_cache()
-        self.update_value()
+        self._trigger = "resync"
+        self.update_value(force=True)
         return self
 
     def _update_self(self, change):
@@ -232,7 +585,11 @@ class ComputedProp(HasTraits):
             assert self._cache_values[h] == change['old'], \
                 f"Previous cache value {self._cache_values[h]} inconsistent with change description {change['old']}"
             self._cache_values[h] = change['new']
-        self.update_value()
+        self._trigger = h
+        if batching():
+            _defer_update(self)
+        else:
+            self.update_value()
 
     def add_input(self, widget, prop="value", name=None, sync=True):
         """ add a widget's property with the current object.
@@ -251,8 +608,13 @@ class ComputedProp(HasTraits):
             # avoid triggering widget getter multiple times
             h = (widget, prop)
             self._cache_values[h] = getattr(widget, prop)
+        else:
+            self._has_unnamed_inputs = True
+        # the arguments of f changed
+        self.invalidate()
         D(f"registering listener on {widget}, {prop}")
-        widget.observe(self._update_self, prop)
+        _observe(self, widget, _WeakHandler(self._update_self), prop)
+        self._sources.append((widget, prop))
         # sync
         if sync:
             self.update_value()
@@ -263,6 +625,7 @@ class ComputedProp(HasTraits):
     def set_output(self, f, sync=True):
         """ f takes an expanded **kwargs, """
         self._f = f
+        self.invalidate()
         if sync:
             self.update_value()
         return self
@@ -313,10 +676,179 @@ class OrProp(ComputedProp):
         self << (p2, dict(name="p2", sync=False))
         self.resync()
 
+########################################
+#           Instrumentation            #
+########################################
+
+# { prop: PropStats, ... } while instrumented, None otherwise
+_stats = None
+
+class PropStats:
+    """ What a prop did while instrumented, see instrument """
+
+    def __init__(self):
+        # evaluations of f for a ComputedProp, value changes for a Prop or SyncedProp
+        self.count = 0
+        # updates of a ComputedProp that didn't evaluate f: unchanged or cached inputs, None inputs
+        self.skipped = 0
+        # time spent evaluating f, or writing the outputs of a SyncedProp, in seconds
+        self.total = 0.0
+        self.max = 0.0
+        # { the input that caused the update: count, ... }, see _trigger_key
+        self.triggers = Counter()
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "skipped": self.skipped,
+            "total_ms": self.total * 1000,
+            "max_ms": self.max * 1000,
+            "triggers": { _trigger_label(trigger): n for trigger, n in self.triggers.most_common() },
+        }
+
+def _record(prop, seconds, trigger):
+    """ record an update of prop, seconds is None when nothing was evaluated """
+    stats = _stats.get(prop)
+    if stats is None:
+        stats = _stats[prop] = PropStats()
+    if seconds is None:
+        stats.skipped += 1
+    else:
+        stats.count += 1
+        stats.total += seconds
+        stats.max = max(stats.max, seconds)
+    if isinstance(trigger, tuple):
+        # labels can change, e.g. with label_props, and the records shouldn't keep widgets alive
+        widget, name = trigger
+        trigger = (weakref.ref(widget), name)
+    stats.triggers[trigger] += 1
+
+def _trigger_label(trigger):
+    if not isinstance(trigger, tuple):
+        return trigger
+    ref, name = trigger
+    widget = ref()
+    label = describe(widget) if widget is not None else "<deleted>"
+    return label if name == 'value' else f"{label}.{name}"
+
+def instrument(enabled=True):
+    """ start recording what every prop does, from scratch, or stop recording with enabled=False
+
+    The records are kept until the next call, see prop_stats and export_graph.
+    """
+    global _stats
+    _stats = weakref.WeakKeyDictionary() if enabled else None
+
+def prop_stats():
+    """ { label: PropStats.as_dict(), ... } of the props updated while instrumented, slowest first """
+    if _stats is None:
+        return {}
+    items = sorted(_stats.items(), key=lambda item: item[1].total, reverse=True)
+    return { describe(prop): stats.as_dict() for prop, stats in items }
+
+def label_props(owner, prefix):
+    """ name the props and widgets in the attributes of owner after them, e.g. 'model.selected_file'
+
+    Lists of (name, prop), like Model.radio_selections, are named 'prefix.attr[name]'.
+    """
+    for attr, value in vars(owner).items():
+        if isinstance(value, HasTraits):
+            value._label = f"{prefix}.{attr}"
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, tuple) and len(item) == 2 and isinstance(item[1], HasTraits):
+                    item[1]._label = f"{prefix}.{attr}[{item[0]}]"
+
+def describe(obj):
+    """ a readable label for a prop or a widget in the graph """
+    label = getattr(obj, '_label', None)
+    if label is not None:
+        return label
+    description = getattr(obj, 'description', None)
+    if isinstance(description, str) and description:
+        return f"{type(obj).__name__}({description!r})"
+    return f"{type(obj).__name__}@{id(obj):x}"
+
+def graph():
+    """ the live prop graph, with the statistics recorded by instrument
+
+    :returns: { 'nodes': [...], 'edges': [...] }. Nodes have an id, a label, a kind, the
+        class name, and the PropStats of the props updated while instrumented.
+        Edges go from an input to a prop, or from a SyncedProp to an output, with the name
+        of the widget property and the name of the input of a ComputedProp.
+
+    """
+    nodes, edges = {}, []
+    def node(obj):
+        key = f"n{id(obj):x}"
+        if key not in nodes:
+            is_prop = obj in _registry
+            nodes[key] = { "id": key, "label": describe(obj), "kind": "prop" if is_prop else "widget",
+                           "type": type(obj).__name__ }
+            if _stats is not None and obj in _stats:
+                nodes[key]["stats"] = _stats[obj].as_dict()
+        return key
+
+    for prop in list(_registry):
+        target = node(prop)
+        names = { tup: name for name, tup in getattr(prop, '_inputs', {}).items() }
+        for widget, name in getattr(prop, '_sources', ()):
+            edges.append({ "source": node(widget), "target": target, "prop": name,
+                           "input": names.get((widget, name)) })
+        for widget, name in getattr(prop, '_output_props', ()):
+            edges.append({ "source": target, "target": node(widget), "prop": name, "input": None })
+    return { "nodes": list(nodes.values()), "edges": edges }
+
+def export_graph(fmt='json'):
+    """ the live prop graph as 'json' or as Graphviz 'dot', see graph
+
+    In dot, the props are shaded by their share of the total time recorded, and
+    labeled with their evaluation count, cumulative and max time.
+    """
+    g = graph()
+    if fmt == 'json':
+        return json.dumps(g, indent=1)
+    if fmt != 'dot':
+        raise ValueError("The fmt parameter must be one of 'json' or 'dot'.")
+
+    total = sum(n["stats"]["total_ms"] for n in g["nodes"] if "stats" in n) or 1.0
+    lines = ["digraph props {", "  rankdir=LR;", "  node [fontsize=10];"]
+    for n in g["nodes"]:
+        label = n["label"]
+        attrs = { "shape": "box" if n["kind"] == "prop" else "ellipse" }
+        if "stats" in n:
+            st = n["stats"]
+            label += (f"\\n{st['count']} evals, {st['skipped']} skipped"
+                      f"\\n{st['total_ms']:.1f} ms total, {st['max_ms']:.1f} ms max")
+            heat = int(255 * (1 - min(1.0, st["total_ms"] / total)))
+            attrs.update(style="filled", fillcolor=f"#ff{heat:02x}{heat:02x}")
+        attrs["label"] = label
+        lines.append(f"  {n['id']} [{_dot_attrs(attrs)}];")
+    for e in g["edges"]:
+        label = e["prop"] if e["input"] is None else f"{e['prop']} as {e['input']}"
+        lines.append(f"  {e['source']} -> {e['target']} [{_dot_attrs({'label': label})}];")
+    lines.append("}")
+    return "\n".join(lines)
+
+def _dot_attrs(attrs):
+    return ", ".join(f'{k}="{_dot_escape(v)}"' for k, v in attrs.items())
+
+def _dot_escape(value):
+    # keep the \\n line breaks of the labels
+    return str(value).replace('"', '\\"')
+
 ########################################
 #  Display-related utilities for Prop  #
 ########################################
 
+def activate_when(cond, *props):
+    """ activate the lazy props only while cond evaluates to True, e.g. while their section is open """
+    def observer(_):
+        for prop in props:
+            prop.set_active(cond.value)
+    cond.observe(observer, 'value')
+    observer(None)
+
 def conditional_widget(cond, widget_if, widget_else=None):
     """ An interactive widget that only gets displayed when cond evaluates to True """
     # TODO: remove the padding? <2022-04-13, David Deng> #
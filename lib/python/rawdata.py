@@ -0,0 +1,212 @@
+""" Reading the yield arrays of the RData files provided by GGCMI.
+
+Each RData file holds yield_grid, yield_grid_ir and yield_grid_rf, every one
+a 720x360x84x5 array of doubles (lon x lat x year x crop). Loading a RData file
+means loading all of them, so the files can be converted offline into a
+chunked, compressed netCDF4 store, with one chunk per variable, crop and year:
+
+    python -m lib.python.rawdata /data/tools/agmip/rdata/*.RData
+
+read_yields reads from the store when there is one, and only touches the
+chunks of the requested crop and years.
+"""
+import argparse
+import os
+import numpy as np
+from . import paths
+from .gridmap import NLAT, NLON
+from .jobs import no_progress
+
+# order of the last dimension of the arrays stored in the RData files
+CROP_NAMES = ["maize", "winter_wheat", "spring_wheat", "soybeans", "rice"]
+VARIABLES = ["yield_grid", "yield_grid_ir", "yield_grid_rf"]
+YIELD_VARIABLE = "yield_grid"
+START_YEAR = 2016
+STORE_EXT = ".nc4"
+
+
+def check_crop(crop):
+    if crop not in CROP_NAMES:
+        raise ValueError(f"Invalid crop: {crop}. Crop must be one of {CROP_NAMES}")
+
+def read_rdata_all(path):
+    """ read every yield array of a RData file
+
+    :path: path to the RData file, e.g. acea_gfdl-esm4_ssp126_default_production_and_yield_grid.RData
+    :returns: { variable: array of shape (lon, lat, year, crop), ... }
+
+    """
+    import rdata
+    converted = rdata.conversion.convert(rdata.parser.parse_file(path))
+    return { variable: np.asarray(converted[variable], dtype=np.float64)
+             for variable in VARIABLES if variable in converted }
+
+def read_rdata(path, crop, variable=YIELD_VARIABLE):
+    """ read one crop of a yield array from a RData file
+
+    :path: path to the RData file
+    :crop: one of CROP_NAMES
+    :variable: one of VARIABLES
+    :returns: a float64 array of shape (year, lat, lon), NaN for missing values
+
+    """
+    check_crop(crop)
+    grid = read_rdata_all(path)[variable]
+    # R stores the array as lon x lat x year x crop
+    return np.ascontiguousarray(grid[..., CROP_NAMES.index(crop)].transpose(2, 1, 0))
+
+
+def store_path(path, store_dir):
+    """ path of the chunked store of a RData file """
+    return os.path.join(store_dir, os.path.splitext(os.path.basename(path))[0] + STORE_EXT)
+
+def has_store(path, store_dir):
+    """ whether the RData file has a chunked store that is at least as recent as itself """
+    if store_dir is None:
+        return False
+    store = store_path(path, store_dir)
+    return os.path.exists(store) and os.path.getmtime(store) >= os.path.getmtime(path)
+
+def convert(path, store, complevel=4, index=None):
+    """ convert a RData file into a chunked store
+
+    :path: path to the RData file
+    :store: path to the netCDF4 file to be created
+    :complevel: zlib compression level
+    :index: a MetadataIndex to add the store to, see lib/python/metadata.py
+
+    """
+    import netCDF4
+    grids = read_rdata_all(path)
+    nyears = next(iter(grids.values())).shape[2]
+    tmp = f"{store}.{os.getpid()}.tmp"
+    with netCDF4.Dataset(tmp, "w", format="NETCDF4") as ds:
+        ds.source = os.path.basename(path)
+        ds.crops = " ".join(CROP_NAMES)
+        ds.createDimension("crop", len(CROP_NAMES))
+        ds.createDimension("time", nyears)
+        ds.createDimension("lat", NLAT)
+        ds.createDimension("lon", NLON)
+        ds.createVariable("time", "i4", ("time",))[:] = np.arange(START_YEAR, START_YEAR + nyears)
+        ds.createVariable("lat", "f8", ("lat",))[:] = np.linspace(89.75, -89.75, NLAT)
+        ds.createVariable("lon", "f8", ("lon",))[:] = np.linspace(-179.75, 179.75, NLON)
+        for variable, grid in grids.items():
+            var = ds.createVariable(variable, "f8", ("crop", "time", "lat", "lon"),
+                                    zlib=True, complevel=complevel, shuffle=True,
+                                    chunksizes=(1, 1, NLAT, NLON), fill_value=np.nan)
+            for i in range(len(CROP_NAMES)):
+                var[i] = grid[..., i].transpose(2, 1, 0)
+    os.replace(tmp, store)
+    if index is not None:
+        index.index_file("store", store)
+
+def read_store(store, crop, variable=YIELD_VARIABLE, years=None, progress=no_progress):
+    """ read one crop of a yield array from a chunked store
+
+    :store: path to the netCDF4 file
+    :crop: one of CROP_NAMES
+    :variable: one of VARIABLES
+    :years: (start, end) inclusive, None to read all years
+    :progress: progress callback, see jobs.Job, called after reading each year
+    :returns: a float64 array of shape (year, lat, lon), NaN for missing values
+
+    """
+    import netCDF4
+    check_crop(crop)
+    with netCDF4.Dataset(store, "r") as ds:
+        ds.set_auto_mask(False)
+        crops = ds.crops.split()
+        time = ds["time"][:]
+        start, end = (0, len(time)) if years is None else np.searchsorted(time, [years[0], years[1] + 1])
+        var = ds[variable]
+        data = np.empty((end - start, NLAT, NLON), dtype=np.float64)
+        # one chunk at a time
+        for i, t in enumerate(range(start, end)):
+            data[i] = var[crops.index(crop), t]
+            progress("read", (i + 1) / len(data))
+        return data
+
+def read_yields(path, crop, variable=YIELD_VARIABLE, store_dir=None, progress=no_progress):
+    """ read one crop of a yield array, from the chunked store in store_dir if there is one
+
+    :path: path to the RData file
+    :progress: progress callback, see jobs.Job. Reports the 'load' stage while a whole
+        RData file is read, which can't be cancelled, and the 'read' stage otherwise.
+    :returns: a float64 array of shape (year, lat, lon), NaN for missing values
+
+    """
+    progress("read", 0.0)
+    if has_store(path, store_dir):
+        return read_store(store_path(path, store_dir), crop, variable, progress=progress)
+    progress("load", 0.0)
+    data = read_rdata(path, crop, variable)
+    progress("read", 1.0)
+    return data
+
+def iter_crops(path, crops, variable=YIELD_VARIABLE, store_dir=None):
+    """ read several crops of a yield array, parsing a RData file without a store only once
+
+    :path: path to the RData file
+    :crops: a list of CROP_NAMES
+    :returns: an iterator of (crop, array of shape (year, lat, lon))
+
+    """
+    for crop in crops:
+        check_crop(crop)
+    if has_store(path, store_dir):
+        for crop in crops:
+            yield crop, read_store(store_path(path, store_dir), crop, variable)
+        return
+    grid = read_rdata_all(path)[variable]
+    for crop in crops:
+        yield crop, np.ascontiguousarray(grid[..., CROP_NAMES.index(crop)].transpose(2, 1, 0))
+
+def extract_crop(path, crop, dest, store_dir):
+    """ write every variable of one crop into a netCDF4 file, reading only that crop from the store
+
+    :path: path to the RData file
+    :dest: path to the netCDF4 file to be created
+
+    """
+    import netCDF4
+    check_crop(crop)
+    with netCDF4.Dataset(store_path(path, store_dir), "r") as src, \
+            netCDF4.Dataset(dest, "w", format="NETCDF4") as dst:
+        src.set_auto_mask(False)
+        dst.source = src.source
+        dst.crop = crop
+        for name in ("time", "lat", "lon"):
+            dst.createDimension(name, len(src[name]))
+            dst.createVariable(name, src[name].dtype, (name,))[:] = src[name][:]
+        i = src.crops.split().index(crop)
+        for variable in VARIABLES:
+            if variable not in src.variables:
+                continue
+            var = dst.createVariable(variable, "f8", ("time", "lat", "lon"), zlib=True,
+                                     chunksizes=(1, NLAT, NLON), fill_value=np.nan)
+            for t in range(len(src["time"])):
+                var[t] = src[variable][i, t]
+
+
+def main(argv=None):
+    """ convert RData files into chunked stores """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("files", nargs="+", help="the RData files to convert")
+    parser.add_argument("--store-dir", default=paths.CHUNKED_DATA_DIR, help="where to write the stores")
+    parser.add_argument("--force", action="store_true", help="convert even if the store is up to date")
+    parser.add_argument("--metadata-index", default=paths.METADATA_INDEX,
+                        help="the metadata index updated with the new stores")
+    args = parser.parse_args(argv)
+    store_dir = args.store_dir
+    from .metadata import MetadataIndex
+    index = MetadataIndex(args.metadata_index)
+    os.makedirs(store_dir, exist_ok=True)
+    for path in args.files:
+        if not args.force and has_store(path, store_dir):
+            print(f"{path}: up to date")
+            continue
+        convert(path, store_path(path, store_dir), index=index)
+        print(f"{path} -> {store_path(path, store_dir)}")
+
+if __name__ == "__main__":
+    main()
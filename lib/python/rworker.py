@@ -0,0 +1,137 @@
+""" Client of the long-lived R aggregation worker in lib/rfunctions/worker.r.
+
+The worker keeps R, its packages and the loaded maps warm between requests.
+Requests are single tab-separated lines on the worker's stdin, and answers
+are single lines on its stdout, prefixed with MARKER. A worker that crashes
+is restarted on the next request.
+"""
+import atexit
+import collections
+import os
+import select
+import subprocess
+import threading
+
+MARKER = "@@AGMIP@@"
+# how often to call the poll callback while waiting for an answer, in seconds
+POLL_INTERVAL = 0.2
+
+
+class RWorkerError(Exception):
+    """ The R worker failed to handle a request """
+
+
+class RWorker:
+    """ A Rscript process running worker.r """
+
+    def __init__(self, script, rscript="Rscript"):
+        self._cmd = [rscript, script]
+        self._proc = None
+        self._buffer = b""
+        self._lock = threading.Lock()
+        # last lines written to stderr, for error messages
+        self._stderr = collections.deque(maxlen=20)
+
+    @property
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        """ start the worker if it isn't running """
+        if self.alive:
+            return self
+        self._proc = subprocess.Popen(self._cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE, bufsize=0)
+        self._buffer = b""
+        threading.Thread(target=self._drain_stderr, args=(self._proc,), daemon=True).start()
+        return self
+
+    def stop(self):
+        """ kill the worker, it will be restarted by the next request """
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+
+    def _drain_stderr(self, proc):
+        for line in proc.stderr:
+            self._stderr.append(line.decode('utf-8', 'replace').rstrip())
+
+    def _readline(self, poll):
+        """ read a line from the worker, None if it exited """
+        fd = self._proc.stdout.fileno()
+        while b"\n" not in self._buffer:
+            if not select.select([fd], [], [], POLL_INTERVAL)[0]:
+                if poll is not None:
+                    poll()
+                continue
+            chunk = os.read(fd, 1 << 16)
+            if not chunk:
+                return None
+            self._buffer += chunk
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line.decode('utf-8', 'replace')
+
+    def _send(self, line, poll):
+        """ send a request and wait for the answer, None if the worker exited """
+        try:
+            self._proc.stdin.write(line.encode('utf-8'))
+        except BrokenPipeError:
+            return None
+        while True:
+            answer = self._readline(poll)
+            if answer is None or answer.startswith(MARKER):
+                return answer
+
+    def request(self, *fields, poll=None):
+        """ send a request to the worker
+
+        :fields: the fields of the request, e.g. 'ping'
+        :poll: called regularly while waiting for the answer. If it raises, the worker is
+            killed and the exception propagated, which is how a request is cancelled.
+        :returns: the payload of the answer
+
+        """
+        line = "\t".join(str(f) for f in fields) + "\n"
+        with self._lock:
+            # retry once on a crash, with a fresh worker
+            for _ in range(2):
+                self.start()
+                try:
+                    answer = self._send(line, poll)
+                except BaseException:
+                    self.stop()
+                    raise
+                if answer is not None:
+                    break
+                self.stop()
+            else:
+                raise RWorkerError("R worker exited: " + "\n".join(self._stderr))
+        status, _, payload = answer[len(MARKER):].strip().partition(" ")
+        if status != "OK":
+            raise RWorkerError(payload)
+        return payload
+
+    def aggregate(self, path, region_map, weight_map, crop, option, output, poll=None):
+        """ aggregate a RData file like do.r, writing the result to output
+
+        :weight_map: path to the weight map csv, None for no weight map
+        :returns: the number of rows of the result
+
+        """
+        return int(self.request("aggregate", path, region_map, weight_map or "null", crop, option, output, poll=poll))
+
+
+# one worker per script for this process
+_workers = {}
+
+def get_worker(script):
+    """ the worker running script in this process, created on first use """
+    if script not in _workers:
+        _workers[script] = RWorker(script)
+    return _workers[script]
+
+@atexit.register
+def _stop_workers():
+    for worker in _workers.values():
+        worker.stop()
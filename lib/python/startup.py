@@ -0,0 +1,55 @@
+""" Lazy imports and startup timing.
+
+Heavy modules that are only needed by some features are imported on first
+use, with lazy_import:
+
+    xr = lazy_import("xarray")  # imported by the first xr.open_dataset(...)
+
+The time taken by each import and initialization phase is recorded with
+timed, and summarized by report, e.g. in the log once the app is running.
+"""
+import importlib
+import time
+import types
+from contextlib import contextmanager
+
+# [(phase, seconds), ...] in the order they ended
+_phases = []
+_started = time.perf_counter()
+
+
+@contextmanager
+def timed(phase):
+    """ record the time taken by the body of the with statement as phase """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((phase, time.perf_counter() - start))
+
+def report():
+    """ the recorded phases, as a text table """
+    lines = [ f"{seconds * 1000:8.1f} ms  {phase}" for phase, seconds in _phases ]
+    lines.append(f"{(time.perf_counter() - _started) * 1000:8.1f} ms  since {__name__} was imported")
+    return "\n".join(lines)
+
+
+class LazyModule(types.ModuleType):
+    """ A module that is only imported when one of its attributes is used """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            with timed(f"import {self.__name__} (lazy)"):
+                self.__dict__['_module'] = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+def lazy_import(name):
+    """ a LazyModule for the module name """
+    return LazyModule(name)
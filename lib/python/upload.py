@@ -1,6 +1,6 @@
 from ipywidgets import FileUpload, Dropdown, Button, VBox, HBox
 from traitlets import Unicode, Bool
-from .prop import ComputedProp, SyncedProp, Prop, conditional_widget, displayable
+from .prop import ComputedProp, SyncedProp, Prop, PropScope, conditional_widget, displayable
 from .utils import get_dir_content
 import os
 
@@ -26,15 +26,24 @@ class Upload(HBox):
 
         self._clear_btn.on_click(lambda _: self._clear_pending_file())
         self._confirm_btn.on_click(lambda _: self._confirm_upload())
-        self._has_pending_file = ComputedProp(use_none=True) << (self._fu, dict(name='v', sync=True)) >> (lambda v: bool(v))
-
-        self._disabled = SyncedProp(value=False) @ (self, dict(prop='disabled'))
 
         self._last_uploaded_file = None
         self._upload_cb = None
         self._error_cb = None
-        SyncedProp() << (~self._has_pending_file | self._disabled) >> (self._clear_btn, dict(prop='disabled')) >> (self._confirm_btn, dict(prop='disabled'))
-        SyncedProp() << (self._has_pending_file | self._disabled) >> (self._fu, dict(prop='disabled'))
+
+        # the props of the widget, disposed by close
+        self._prop_scope = PropScope()
+        with self._prop_scope:
+            self._has_pending_file = ComputedProp(use_none=True) << (self._fu, dict(name='v', sync=True)) >> (lambda v: bool(v))
+
+            self._disabled = SyncedProp(value=False) @ (self, dict(prop='disabled'))
+
+            SyncedProp() << (~self._has_pending_file | self._disabled) >> (self._clear_btn, dict(prop='disabled')) >> (self._confirm_btn, dict(prop='disabled'))
+            SyncedProp() << (self._has_pending_file | self._disabled) >> (self._fu, dict(prop='disabled'))
+
+    def close(self):
+        self._prop_scope.dispose()
+        super().close()
 
     def _handle_error(self, msg="Error encountered uploading file"):
         if self._error_cb is not None:
@@ -91,29 +100,31 @@ class SelectOrUpload(VBox):
         self._select = Dropdown(options=get_dir_content(select_dir))
         self._upload = Upload(upload_dir=upload_dir, upload_fname=upload_fname, overwrite=overwrite)
 
-        # whether to use the uploaded file or the selected file
-        self.use_upload = Prop(value=False)
-        self.uploaded_file = Prop(value=None)
-
-        self.target_file = ComputedProp(use_none=True) \
-            << (self.use_upload, dict(name='use_upload')) \
-            << (self.uploaded_file, dict(name='upl')) \
-            << (self._select, dict(name="sel")) \
-            >> (lambda use_upload, upl, sel: upl if use_upload else os.path.join(select_dir, sel)) # upl is already the absolute path
-
-        self.value = Unicode()
-        SyncedProp() << self.target_file >> self
-
-
         # button to switch back to selection mode
         self._use_select_btn = Button(description="Use Existing Files")
         self._use_select_btn.on_click(self._cb_use_upload_false)
 
-        self._disabled = SyncedProp(value=False) \
-            @ (self, dict(prop='disabled')) \
-            >> (self._upload, dict(prop='disabled')) \
-            >> (self._select, dict(prop='disabled')) \
-            >> (self._use_select_btn, dict(prop='disabled'))
+        # the props of the widget, disposed by close
+        self._prop_scope = PropScope()
+        with self._prop_scope:
+            # whether to use the uploaded file or the selected file
+            self.use_upload = Prop(value=False)
+            self.uploaded_file = Prop(value=None)
+
+            self.target_file = ComputedProp(use_none=True) \
+                << (self.use_upload, dict(name='use_upload')) \
+                << (self.uploaded_file, dict(name='upl')) \
+                << (self._select, dict(name="sel")) \
+                >> (lambda use_upload, upl, sel: upl if use_upload else os.path.join(select_dir, sel)) # upl is already the absolute path
+
+            self.value = Unicode()
+            SyncedProp() << self.target_file >> self
+
+            self._disabled = SyncedProp(value=False) \
+                @ (self, dict(prop='disabled')) \
+                >> (self._upload, dict(prop='disabled')) \
+                >> (self._select, dict(prop='disabled')) \
+                >> (self._use_select_btn, dict(prop='disabled'))
 
         children = [
             displayable(self.target_file),
@@ -127,6 +138,11 @@ class SelectOrUpload(VBox):
 
         self._upload.on_upload(self._cb_use_upload_true)
 
+    def close(self):
+        self._prop_scope.dispose()
+        self._upload.close()
+        super().close()
+
     def _cb_use_upload_true(self, payload):
         self.uploaded_file.value = payload['path']
         self.use_upload.value = True
@@ -2,19 +2,27 @@ from os import listdir
 from os.path import isfile, isdir, join, basename, splitext
 import ipywidgets as widgets
 import branca.colormap as cm
-from statistics import stdev, quantiles
-import xarray as xr
-import pandas as pd
+import numpy as np
 import re
 import io
 from zipfile import ZipFile
 from lib.python.prop import conditional_widget, displayable
+from lib.python.cube import row_statistics
+from lib.python.startup import lazy_import
+
+# only needed to combine netCDF files
+xr = lazy_import("xarray")
+pd = lazy_import("pandas")
 
 # For DownloadButton
-import base64
-import hashlib
-from typing import Callable
+import json
+from typing import Callable, Iterable, Union
 from IPython.display import HTML
+from lib.python.download import get_server
+
+
+# from the lowest to the highest values
+COLORMAP_COLORS = ['white', 'green', 'yellow', 'orange', 'darkred']
 
 
 def is_float(n):
@@ -50,28 +58,79 @@ def get_yield_variable(f):
 def get_colormap(data=None):
     """get a branca.colormap object adapted to the data
 
-    :data: list of data
+    :data: list of data, NaN values are ignored
     :returns: a colormap
 
     """
-    colors = ['white', 'green', 'yellow', 'orange', 'darkred']
     if data is None:
-        return cm.LinearColormap(colors=colors)
-    mn = min(data)
-    mx = max(data)
-    data_nozero = [ d for d in data if d > 0 ]
-    qt = quantiles(data_nozero)
-    return cm.LinearColormap(colors=colors, index=[mn, *qt, mx], vmin=round(mn, 2), vmax=round(mx, 2))
-
-def get_summary_info(data):
-    qt1, qt2, qt3 = quantiles(data)
+        return cm.LinearColormap(colors=COLORMAP_COLORS)
+    stats = row_statistics(np.asarray([data], dtype=np.float64))
+    return get_statistics_colormap({ name: values[0].item() for name, values in stats.items() })
+
+def get_statistics_colormap(stats):
+    """get a branca.colormap object adapted to precomputed statistics
+
+    :stats: statistics of the data, see cube.row_statistics and RegionCube.year_statistics
+    :returns: a colormap spanning min to max, with the quartiles of the positive values as stops
+
+    """
+    if stats is None or stats['count'] == 0:
+        return cm.LinearColormap(colors=COLORMAP_COLORS)
+    mn, mx = stats['min'], stats['max']
+    if stats['positive_count'] < 2:
+        return cm.LinearColormap(colors=COLORMAP_COLORS, vmin=round(mn, 2), vmax=round(mx, 2))
+    qt = [stats['pq1'], stats['pq2'], stats['pq3']]
+    return cm.LinearColormap(colors=COLORMAP_COLORS, index=[mn, *qt, mx], vmin=round(mn, 2), vmax=round(mx, 2))
+
+def get_colors(colormap, values):
+    """the colors of many values at once, like calling the colormap on each of them
+
+    :colormap: a branca LinearColormap
+    :values: array of values
+    :returns: a list of "#RRGGBBAA" strings, None for NaN values
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    index, colors = np.asarray(colormap.index, dtype=np.float64), np.asarray(colormap.colors)
+    rgba = np.stack([ np.interp(values, index, colors[:, c]) for c in range(4) ], axis=-1)
+    rgba = (np.nan_to_num(rgba) * 255.9999999).astype(np.uint8)
+    return [ None if isnan else "#%02x%02x%02x%02x" % tuple(c) for isnan, c in zip(np.isnan(values).tolist(), rgba.tolist()) ]
+
+def legend_html(colormap, year=None, hidden=False):
+    """a compact html legend of a colormap, a gradient bar between its bounds
+
+    :colormap: a branca LinearColormap
+    :year: stored in the data-year attribute of the legend
+    :hidden: whether to hide the legend
+    :returns: a html string
+
+    """
+    lo, hi = colormap.index[0], colormap.index[-1]
+    span = (hi - lo) or 1
+    stops = ", ".join(f"{colormap.rgb_hex_str(x)} {(x - lo) / span * 100:.1f}%" for x in colormap.index)
+    style = ' style="display:none"' if hidden else ''
+    label = '' if year is None else year
+    return (f'<div class="agmip-year-legend" data-year="{label}"{style}>'
+            f'<div style="width:300px;height:12px;background:linear-gradient(to right, {stops})"></div>'
+            f'<div style="width:300px;display:flex;justify-content:space-between">'
+            f'<span>{colormap.vmin}</span><span>{label}</span><span>{colormap.vmax}</span></div></div>')
+
+def get_summary_info(stats):
+    """summary statistics to display
+
+    :stats: precomputed statistics, see RegionCube.year_statistics
+    :returns: a dict, None if there are less than 2 values
+
+    """
+    if stats is None or stats['count'] < 2:
+        return None
     return {
-        "Max": round(max(data), 2),
-        "Min": round(min(data), 2),
-        "Standard Deviation": round(stdev(data), 2),
-        "1st Quantile": round(qt1, 2),
-        "2nd Quantile": round(qt2, 2),
-        "3rd Quantile": round(qt3, 2),
+        "Max": round(stats['max'], 2),
+        "Min": round(stats['min'], 2),
+        "Standard Deviation": round(stats['sd'], 2),
+        "1st Quantile": round(stats['q1'], 2),
+        "2nd Quantile": round(stats['q2'], 2),
+        "3rd Quantile": round(stats['q3'], 2),
     }
 
 year_regex = re.compile(r"(?P<base>.*)_(?P<start>[0-9]{4})_(?P<end>[0-9]{4})\.(?P<ext>\w{1,3})")
@@ -257,39 +316,38 @@ def hbox_scattered(*items):
     return ret
 
 
-# https://stackoverflow.com/questions/61708701/how-to-download-a-file-using-ipywidget-button
 class DownloadButton(widgets.Button):
     """Download button with dynamic content
 
-    The content is generated using a callback when the button is clicked.
+    The content is generated using a callback when the button is clicked, and
+    streamed to the browser by the kernel's download server, see lib/python/download.py.
     """
 
-    def __init__(self, filename: str, contents: Callable[[], bytes], **kwargs):
+    def __init__(self, filename: str, contents: Callable[[], Union[bytes, Iterable[bytes]]], **kwargs):
         super(DownloadButton, self).__init__(**kwargs)
         self.filename = filename
         self.contents = contents
         self.on_click(self.__on_click)
 
     def __on_click(self, b):
-        contents: bytes = self.contents() # .encode('utf-8')
-        b64 = base64.b64encode(contents)
-        payload = b64.decode()
-        digest = hashlib.md5(contents).hexdigest()  # bypass browser cache
-        id = f'dl_{digest}'
-
+        # a generator only runs once the browser requests the download
+        server = get_server()
+        url = server.url(server.register(self.filename, self.contents()))
+        # JavaScript strings that can't close the script element
+        url, filename = (json.dumps(s).replace("</", "<\\/") for s in (url, self.filename))
+        # resolved against the Jupyter base URL, from the page config of Lab, Voila or the classic notebook
         display(HTML(f"""
-<html>
-<body>
-<a id="{id}" download="{self.filename}" href="data:text/csv;base64,{payload}" download>
-</a>
-
 <script>
 (function download() {{
-document.getElementById('{id}').click();
+var config = document.getElementById('jupyter-config-data');
+var base = (config && JSON.parse(config.textContent).baseUrl) || document.body.dataset.baseUrl || '/';
+var a = document.createElement('a');
+a.href = new URL({url}, new URL(base, window.location.href)).href;
+a.download = {filename};
+document.body.appendChild(a);
+a.click();
+a.remove();
 }})()
 </script>
-
-</body>
-</html>
 """))
 
@@ -39,6 +39,40 @@ read.AgMIP.nc <- function(file, start_year, end_year, yield_crop, var_lon, var_l
 }
 
 
+#########################################################################
+## read.AgMIP.RData: reads one crop of the yield data of the second
+## generation of GGCMI runs, see do.r. Each RData file has a yield_grid
+## array of dimensions 720x360xYx5 [lon x lat x years from 2016 x 5
+## crops]. The function produces a dataset with four columns
+## ("lon","lat","time","value"), ready to be aggregated by grid.agg.
+## yield.grid.long does the same from a yield_grid already loaded, e.g.
+## kept loaded between requests by worker.r.
+#########################################################################
+
+AgMIP.cropnames <- c("maize", "winter_wheat", "spring_wheat", "soybeans", "rice")
+
+yield.grid.long <- function(yield_grid, crop){
+    if( !crop %in% AgMIP.cropnames )
+        stop('Specify one of maize, winter_wheat, spring_wheat, soybeans, rice')
+    ## Add names to the dimensions of the array:
+    lons <- seq(from = -179.75, to = 179.75, by = 0.5)
+    lats <- seq(from = 89.75, to = -89.75, by = -0.5)
+    years <- c(2016:(2016 + dim(yield_grid)[3] - 1))
+    dimnames(yield_grid) <- list(lons, lats, years, AgMIP.cropnames)
+    ## Collapse the array of the crop so it becomes a column:
+    require(reshape2, quietly=TRUE)
+    yield.long <- reshape2::melt(yield_grid[,,,crop])
+    names(yield.long) <- c("lon","lat","time","value")
+    ## Eliminate NAs
+    yield.long[complete.cases(yield.long),]
+}
+
+read.AgMIP.RData <- function(file, crop){
+    load(file)
+    yield.grid.long(yield_grid, crop)
+}
+
+
 grid.agg <- function(data2agg=NULL, region.map=NULL, agg.function= "production", weight.map=NULL, crop_name=NULL){
     require(dplyr, quietly=TRUE)
     ## Check data to be aggregated:
@@ -57,7 +91,7 @@ grid.agg <- function(data2agg=NULL, region.map=NULL, agg.function= "production",
         c("id") %in% names(region.map))==FALSE)
         stop('Regional mapping must be labeled lon, lat, and id')
     ## Merge AgMIP yields with regional mapping:
-    suppressMessages(d <- left_join(data2agg, region.map, by.x=c("lon","lat"), by.y=c("lon","lat")))
+    suppressMessages(d <- left_join(data2agg, region.map, by=c("lon","lat")))
     d <- d[complete.cases(d),]
     ## AGGREGATION
     if(agg.function %in% c("summary")){
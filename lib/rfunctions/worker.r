@@ -0,0 +1,97 @@
+## worker.r: a long-lived aggregation worker, started and fed by
+## lib/python/rworker.py. Packages, region maps, weight maps and the
+## most recently used RData file stay loaded between requests, so that
+## only the first request pays for starting R.
+##
+## Requests are read from stdin, one per line, fields separated by tabs:
+##   ping
+##   aggregate <rdata_file> <regionmap_file> <weightmap_file|null> <crop> <st|wa> <output_file>
+## Each request is answered by a single line on stdout, starting with
+## MARKER, so that anything else printed on stdout is ignored:
+##   @@AGMIP@@ OK <payload>
+##   @@AGMIP@@ ERR <message>
+## The worker exits when stdin is closed.
+
+suppressMessages({
+    require(dplyr, quietly=TRUE)
+    require(reshape2, quietly=TRUE)
+})
+options(dplyr.summarise.inform=FALSE)
+
+## the reader and grid.agg of the legacy scripts, next to this one
+script.file <- sub("^--file=", "", grep("^--file=", commandArgs(trailingOnly=FALSE), value=TRUE)[1])
+source(file.path(dirname(script.file), "agmip.fns.r"))
+
+MARKER <- "@@AGMIP@@"
+cache <- new.env()
+
+## cached: load a file with the function load, unless it was loaded
+## before and has not been modified since.
+cached <- function(kind, file, load){
+    key <- paste(kind, file, sep=":")
+    mtime <- file.info(file)$mtime
+    if(is.na(mtime))
+        stop(paste("No such file:", file))
+    entry <- cache[[key]]
+    if(is.null(entry) || entry$mtime != mtime){
+        entry <- list(mtime=mtime, value=load(file))
+        assign(key, entry, envir=cache)
+    }
+    entry$value
+}
+
+## load.yield.grid: yield_grid of a RData file. Only the last file is
+## kept, as each one holds about 1.7 GB of arrays.
+load.yield.grid <- function(file){
+    mtime <- file.info(file)$mtime
+    if(is.na(mtime))
+        stop(paste("No such file:", file))
+    entry <- cache$rdata
+    if(is.null(entry) || entry$file != file || entry$mtime != mtime){
+        cache$rdata <- NULL
+        gc()
+        env <- new.env()
+        load(file, envir=env)
+        entry <- list(file=file, mtime=mtime, yield_grid=env$yield_grid)
+        rm(env)
+        gc()
+        assign("rdata", entry, envir=cache)
+    }
+    entry$yield_grid
+}
+
+## the agg.function of grid.agg for each aggregation option
+agg.functions <- c(st="summary", wa="weighted.m.custom")
+
+handle.aggregate <- function(rdata_file, regionmap_file, weightmap_file, crop, option, output_file){
+    region.map <- cached("regionmap", regionmap_file, read.csv)
+    weight.map <- if(weightmap_file == "null") NULL else cached("weightmap", weightmap_file, read.csv)
+    if( !option %in% names(agg.functions) )
+        stop(paste("Unknown aggregation option:", option))
+    agg <- grid.agg(data2agg=yield.grid.long(load.yield.grid(rdata_file), crop),
+                    region.map=region.map, agg.function=agg.functions[[option]], weight.map=weight.map)
+    write.csv(agg, file=output_file)
+    nrow(agg)
+}
+
+respond <- function(status, payload){
+    cat(paste(MARKER, status, gsub("[\r\n]+", " ", payload)), "\n", sep="")
+    flush(stdout())
+}
+
+con <- file("stdin", open="r")
+repeat {
+    line <- readLines(con, n=1)
+    if(length(line) == 0)
+        break
+    fields <- strsplit(line, "\t", fixed=TRUE)[[1]]
+    tryCatch({
+        if(fields[1] == "ping"){
+            respond("OK", "pong")
+        }else if(fields[1] == "aggregate" && length(fields) == 7){
+            respond("OK", do.call(handle.aggregate, as.list(fields[-1])))
+        }else{
+            stop(paste("Invalid request:", line))
+        }
+    }, error=function(e) respond("ERR", conditionMessage(e)))
+}
@@ -0,0 +1,104 @@
+""" The NumPy engine must give the results of grid.agg in lib/rfunctions/agmip.fns.r,
+see lib/python/aggregate.py. The expected values follow R: type 7 quantiles, sd
+with n - 1, weighted.mean over the non-missing values, and no row for the
+regions and years without any value.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+from lib.python.aggregate import SUMMARY_COLUMNS, WEIGHTED_AVERAGE_COLUMN, aggregate
+from lib.python.gridmap import NLAT, NLON, lat_index, lon_index, read_region_map, read_weight_map
+
+nan = np.nan
+START_YEAR = 2016
+
+# (lon, lat, region id, weight or None, values of the three years)
+CELLS = [
+    (-179.75, 89.75, "A", 1, [1, 2, nan]),
+    (-179.25, 89.75, "A", 1, [2, nan, nan]),
+    (-178.75, 89.75, "A", 2, [3, 4, nan]),
+    (10.25, 0.25, "A", 0, [4, 6, nan]),
+    (10.75, 0.25, "A", None, [10, 8, nan]),
+    (20.25, -45.25, "B", 1, [5, 3, 1]),
+    (20.25, -45.75, "B", 3, [7, nan, 2]),
+    # no value in any year
+    (30.25, 10.25, "C", 1, [nan, nan, nan]),
+    # weights summing to 0
+    (40.25, 10.25, "E", 0, [5, 5, 5]),
+    # outside any region
+    (50.25, 10.25, "NA", 1, [100, 100, 100]),
+]
+
+# (id, year, mean, median, sd, min, pctle25, pctle75, max)
+SUMMARY = [
+    ("A", 2016, 4.0, 3.0, 3.5355339059327378, 1.0, 2.0, 4.0, 10.0),
+    ("A", 2017, 5.0, 5.0, 2.581988897471611, 2.0, 3.5, 6.5, 8.0),
+    ("B", 2016, 6.0, 6.0, 1.4142135623730951, 5.0, 5.5, 6.5, 7.0),
+    ("B", 2017, 3.0, 3.0, nan, 3.0, 3.0, 3.0, 3.0),
+    ("B", 2018, 1.5, 1.5, 0.7071067811865476, 1.0, 1.25, 1.75, 2.0),
+    ("E", 2016, 5.0, 5.0, nan, 5.0, 5.0, 5.0, 5.0),
+    ("E", 2017, 5.0, 5.0, nan, 5.0, 5.0, 5.0, 5.0),
+    ("E", 2018, 5.0, 5.0, nan, 5.0, 5.0, 5.0, 5.0),
+]
+
+# (id, year, w.ave.yield)
+WEIGHTED_AVERAGE = [
+    ("A", 2016, 2.25),
+    ("A", 2017, 10 / 3),
+    ("B", 2016, 6.5),
+    ("B", 2017, 3.0),
+    ("B", 2018, 1.75),
+    ("E", 2016, nan),
+    ("E", 2017, nan),
+    ("E", 2018, nan),
+]
+
+
+@pytest.fixture
+def grid(tmp_path):
+    """ (data, region_map, weight_map) of CELLS, the maps being read from csv files like the app's """
+    data = np.full((3, NLAT, NLON), nan)
+    region_map, weight_map = tmp_path / "regions.csv", tmp_path / "weights.csv"
+    with open(region_map, 'w') as regions, open(weight_map, 'w') as weights:
+        regions.write("lon,lat,id\n")
+        weights.write("lon,lat,weight\n")
+        for lon, lat, rid, weight, values in CELLS:
+            data[:, lat_index(lat), lon_index(lon)] = values
+            regions.write(f"{lon},{lat},{rid}\n")
+            weights.write(f"{lon},{lat},{'NA' if weight is None else weight}\n")
+    return data, read_region_map(region_map), read_weight_map(weight_map)
+
+def rows(result):
+    """ the rows of an AggregationResult as (id, year, *values) """
+    return [ (str(result.ids[r]), int(t), *(float(v) for v in values))
+             for r, t, *values in zip(result.region, result.time, *result.columns.values()) ]
+
+def assert_rows(actual, expected):
+    assert [ row[:2] for row in actual ] == [ row[:2] for row in expected ]
+    np.testing.assert_allclose(np.array([ row[2:] for row in actual ]),
+                               np.array([ row[2:] for row in expected ]), rtol=1e-12)
+
+def test_summary_statistics(grid):
+    data, (codes, ids), _ = grid
+    result = aggregate(data, codes, ids, 'st', start_year=START_YEAR)
+    assert list(result.columns) == SUMMARY_COLUMNS
+    assert_rows(rows(result), SUMMARY)
+
+def test_weighted_average(grid):
+    data, (codes, ids), weights = grid
+    result = aggregate(data, codes, ids, 'wa', weights, start_year=START_YEAR)
+    assert list(result.columns) == [WEIGHTED_AVERAGE_COLUMN]
+    assert_rows(rows(result), WEIGHTED_AVERAGE)
+
+def test_csv(grid):
+    data, (codes, ids), _ = grid
+    lines = aggregate(data, codes, ids, 'st', start_year=START_YEAR).csv().splitlines()
+    assert lines[0] == '"","id","time","mean","median","sd","min","pctle25","pctle75","max"'
+    assert lines[1] == '"1","A",2016,4,3,3.53553390593274,1,2,4,10'
+    assert lines[4] == '"4","B",2017,3,3,NA,3,3,3,3'
+
+def test_no_cells(grid):
+    data, (codes, ids), _ = grid
+    result = aggregate(data, np.full_like(codes, -1), ids, 'st', start_year=START_YEAR)
+    assert len(result) == 0 and list(result.columns) == SUMMARY_COLUMNS
@@ -0,0 +1,63 @@
+""" Props that are rebuilt many times must not leak, see PropScope and dispose in lib/python/prop.py
+
+    python -m pytest tests
+"""
+import gc
+import tracemalloc
+from lib.python import Prop, SyncedProp, ComputedProp, PropScope
+from lib.python.prop import _registry
+
+CYCLES = 5000
+# the memory that may be retained after the warm-up, e.g. by interned strings and free lists
+MAX_GROWTH = 256 * 1024
+
+
+def observer_count(obj):
+    """ the number of observers registered on a HasTraits """
+    return sum(len(handlers) for by_type in obj._trait_notifiers.values() for handlers in by_type.values())
+
+def build(a, b, out):
+    """ a ComputedProp of two long-lived inputs, synced to a long-lived output """
+    total = ComputedProp()
+    total << (a, dict(name="x")) << (b, dict(name="y")) >> (lambda x, y: x + y)
+    SyncedProp() << (total, dict(sync=True)) >> (out, dict(sync=True))
+    return total
+
+def rebuild(cycles, dispose=True):
+    """ build, use and drop the props of a scope cycles times
+
+    :dispose: dispose of each scope, rather than relying on the garbage collection of its props
+    :returns: the memory allocated by the cycles after a warm-up, in bytes
+
+    """
+    a, b, out = Prop(value=0), SyncedProp(value=1), Prop(value=None)
+    baseline = { "a": observer_count(a), "b": observer_count(b), "out": observer_count(out) }
+    registered = len(_registry)
+    warm_up = cycles // 10
+    tracemalloc.start()
+    try:
+        for i in range(cycles):
+            if i == warm_up:
+                gc.collect()
+                start = tracemalloc.get_traced_memory()[0]
+            scope = PropScope()
+            with scope:
+                build(a, b, out)
+            a.value = i
+            assert out.value == i + 1
+            if dispose:
+                scope.dispose()
+            del scope
+        gc.collect()
+        growth = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    assert { "a": observer_count(a), "b": observer_count(b), "out": observer_count(out) } == baseline
+    assert len(_registry) == registered
+    return growth
+
+def test_disposed_scopes_release_their_props():
+    assert rebuild(CYCLES) < MAX_GROWTH
+
+def test_collected_scopes_release_their_props():
+    assert rebuild(CYCLES // 5, dispose=False) < MAX_GROWTH
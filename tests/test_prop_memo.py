@@ -0,0 +1,45 @@
+""" ComputedProp skips the evaluations of unchanged inputs and reuses cached outputs,
+but only for inputs of the same type, see _equal in lib/python/prop.py
+
+    python -m pytest tests
+"""
+from lib.python import Prop, ComputedProp, batch
+
+
+def counted(cache_size=0):
+    """ (input, prop, calls): a ComputedProp describing its input, and the evaluations of its function """
+    calls = []
+    x = Prop(value=0)
+    def f(x):
+        calls.append(x)
+        return repr(x)
+    prop = ComputedProp(cache_size=cache_size)
+    prop << (x, dict(name="x")) >> f
+    return x, prop, calls
+
+def test_unchanged_inputs_are_not_evaluated():
+    x, prop, calls = counted()
+    x.value = 0
+    assert calls == [0]
+
+def test_equal_inputs_of_other_types_are_evaluated():
+    x, prop, calls = counted()
+    # the changes of a batch are propagated once, from 0 to False
+    with batch():
+        x.value = 1
+        x.value = False
+    assert prop.value == "False"
+    with batch():
+        x.value = 1
+        x.value = (0,)
+    with batch():
+        x.value = 1
+        x.value = (False,)
+    assert calls == [0, False, (0,), (False,)]
+
+def test_cached_outputs_of_other_types_are_not_reused():
+    x, prop, calls = counted(cache_size=8)
+    for value in (1, 2, True, 2, 1.0, 2, 1):
+        x.value = value
+        assert prop.value == repr(value)
+    assert calls == [0, 1, 2, True, 1.0]